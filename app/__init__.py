@@ -1,16 +1,58 @@
+import logging
+import resource
+import sys
+import time
+
+IMPORT_STARTED = time.perf_counter()
+
 from flask import Flask
 from app.config import load_configurations, configure_logging
 from .views import webhook_blueprint
+from .services.job_queue import init_job_queue
+from .services.transcription_service import get_transcriber
+from .utils.whatsapp_utils import process_webhook_event
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FINISHED = time.perf_counter()
+
+HEAVY_MODULES = ("torch", "whisper", "google.generativeai")
+
+
+def log_startup_report(started):
+    """
+    Log how long importing the app and creating it took, peak memory, and
+    whether any heavy transcription dependencies were imported eagerly.
+    """
+    import_ms = (IMPORT_FINISHED - IMPORT_STARTED) * 1000
+    create_ms = (time.perf_counter() - started) * 1000
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    logger.info(
+        f"App ready: imports {import_ms:.0f} ms, create_app {create_ms:.0f} ms, "
+        f"max RSS {max_rss_mb:.0f} MB, heavy modules loaded: {', '.join(loaded) or 'none'}"
+    )
 
 
 def create_app():
+    started = time.perf_counter()
     app = Flask(__name__)
 
-    # Load configurations and logging settings
     load_configurations(app)
+
+    # The local Whisper pool forks worker processes, which must happen
+    # before any background threads exist, including the log listener
+    if app.config["TRANSCRIPTION_PROVIDER"] == "whisper":
+        with app.app_context():
+            get_transcriber()
+
     configure_logging()
 
     # Import and register blueprints, if any
     app.register_blueprint(webhook_blueprint)
 
+    # Start the background workers that process queued webhook events
+    init_job_queue(app, process_webhook_event)
+
+    log_startup_report(started)
     return app
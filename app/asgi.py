@@ -0,0 +1,388 @@
+import asyncio
+import hmac
+import json
+import logging
+import uuid
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+from flask import Flask
+
+from app.config import configure_logging, load_configurations
+from app.decorators.security import validate_signature
+from app.services.async_delivery_service import create_async_delivery_service
+from app.services.async_graph_client import create_async_graph_client
+from app.services.conversation_store import get_conversation_store
+from app.services.dedup_service import MessageDeduplicator
+from app.services.history_store import get_history_store
+from app.services.mailbox_service import AsyncConversationMailbox
+from app.services.media_service import MediaError
+from app.services.openai_service import (
+    generate_response_async,
+    get_answer_cache,
+    get_knowledge_index,
+    prepare_conversation_async,
+)
+from app.services.transcription_cache import TranscriptionCache, content_key, media_key
+from app.services.transcription_service import get_transcriber, transcribe_audio_async
+from app.utils.json_utils import loads
+from app.utils.logging_utils import bind_log_context, log_context, unbind_log_context
+from app.utils.metrics import registry, track
+from app.utils.webhook_parser import parse_webhook
+from app.utils.whatsapp_utils import (
+    MEDIA_DOWNLOAD_HEADERS,
+    TRANSCRIPTION_CACHE_LOOKUPS,
+    get_read_receipt_input,
+    get_text_message_input,
+    process_text_for_whatsapp,
+)
+from app.utils.segmenter import ReplySegmenter, split_text
+from app.views import WEBHOOK_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+JSON = "application/json"
+TEXT = "text/plain; charset=utf-8"
+
+
+class WebhookApp:
+    """
+    Raw ASGI application serving the same endpoints as the Flask blueprint
+    (GET/POST /webhook, GET /metrics) on one asyncio event loop.
+
+    Each accepted message becomes a task instead of a job for a worker
+    thread, and every outbound call (Graph, OpenAI, Gemini) is awaited, so a
+    single process can keep thousands of conversations in flight. Signature
+    checks, parsing, deduplication and the per-user mailbox rules are shared
+    with the Flask app. Services shared with it read current_app.config, so
+    a bare Flask app holds the configuration and every request (and the
+    tasks it spawns) runs inside its app context.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.flask_app = Flask(__name__)
+        self.flask_app.config.update(config)
+        self.deduplicator = MessageDeduplicator(path=config["DEDUP_DB_PATH"], ttl=config["DEDUP_TTL"])
+        self.transcription_cache = TranscriptionCache(
+            path=config["TRANSCRIPTION_CACHE_PATH"],
+            memory_size=config["TRANSCRIPTION_CACHE_SIZE"],
+            ttl=config["TRANSCRIPTION_CACHE_TTL"],
+            max_disk_bytes=config["TRANSCRIPTION_CACHE_MAX_BYTES"],
+        )
+        self.graph_client = create_async_graph_client(config)
+        self.delivery = create_async_delivery_service(self.graph_client, config)
+        self.mailbox = AsyncConversationMailbox(
+            self.reply,
+            debounce=config["MESSAGE_DEBOUNCE_MS"] / 1000,
+            max_batch=config["MESSAGE_MAX_BATCH"],
+        )
+        self._tasks = set()
+
+        with self.flask_app.app_context():
+            # The local Whisper pool forks worker processes, which must happen
+            # before the server starts its event loop
+            if config["TRANSCRIPTION_PROVIDER"] == "whisper":
+                get_transcriber()
+            # Load (or build) the knowledge index now rather than on the event loop
+            if config["RETRIEVAL_ENABLED"]:
+                get_knowledge_index()
+            # Open the stores now too, rather than on the event loop
+            get_answer_cache()
+            if config["RESPONSE_ENGINE"] == "chat":
+                get_history_store()
+            else:
+                get_conversation_store()
+
+    async def __call__(self, scope, receive, send):
+        with self.flask_app.app_context():
+            await self._handle(scope, receive, send)
+
+    async def _handle(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+        token = bind_log_context(request_id=headers.get("x-request-id") or uuid.uuid4().hex)
+        try:
+            status, body, content_type = await self._route(scope, headers, receive)
+        except Exception as e:
+            logger.error(f"Exception in ASGI request: {e}")
+            status, body, content_type = 500, {"status": "error", "message": str(e)}, JSON
+        finally:
+            unbind_log_context(token)
+
+        payload = json.dumps(body).encode("utf-8") if content_type == JSON else body.encode("utf-8")
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", content_type.encode("latin-1")), (b"content-length", str(len(payload)).encode())],
+            }
+        )
+        await send({"type": "http.response.body", "body": payload})
+
+    async def _route(self, scope, headers, receive):
+        path, method = scope["path"], scope["method"]
+        if path == "/webhook" and method == "GET":
+            return self.verify(parse_qs(scope["query_string"].decode("latin-1")))
+        if path == "/webhook" and method == "POST":
+            payload = await self._read_body(receive)
+            signature = headers.get("x-hub-signature-256", "")[7:]  # Removing 'sha256='
+            if not validate_signature(payload, signature, self.config["APP_SECRET"]):
+                logger.info("Signature verification failed!")
+                return 403, {"status": "error", "message": "Invalid signature"}, JSON
+            try:
+                body = loads(payload)
+            except ValueError:
+                logger.error("Failed to decode JSON")
+                return 400, {"status": "error", "message": "Invalid JSON provided"}, JSON
+            with track("webhook"):
+                return await self.handle_message(body)
+        if path == "/metrics" and method == "GET":
+            token = self.config["METRICS_TOKEN"]
+            if token and not hmac.compare_digest(headers.get("authorization", ""), f"Bearer {token}"):
+                return 401, {"status": "error", "message": "Unauthorized"}, JSON
+            return 200, registry.render(), "text/plain; version=0.0.4; charset=utf-8"
+        return 404, {"status": "error", "message": "Not found"}, JSON
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                return b"".join(chunks)
+
+    def verify(self, args):
+        mode = args.get("hub.mode", [None])[0]
+        token = args.get("hub.verify_token", [None])[0]
+        challenge = args.get("hub.challenge", [""])[0]
+
+        if mode and token:
+            if mode == "subscribe" and token == self.config["VERIFY_TOKEN"]:
+                logger.info("WEBHOOK_VERIFIED")
+                return 200, challenge, TEXT
+            logger.info("VERIFICATION_FAILED")
+            return 403, {"status": "error", "message": "Verification failed"}, JSON
+        logger.info("MISSING_PARAMETER")
+        return 400, {"status": "error", "message": "Missing parameters"}, JSON
+
+    async def handle_message(self, body):
+        """
+        views.handle_message for the event loop: messages are scheduled as
+        tasks, and the in-flight limit plays the role of the job queue bound.
+        Claims go through SQLite, so they run in a thread off the loop.
+        """
+        batch = parse_webhook(body)
+        if batch.statuses:
+            logger.info(f"Received {len(batch.statuses)} WhatsApp status update(s).")
+
+        if batch.messages:
+            rejected = 0
+            for message in batch.messages:
+                if message.id and not await asyncio.to_thread(self.deduplicator.claim, message.id):
+                    logger.info(f"Ignoring duplicate delivery of message {message.id}")
+                    WEBHOOK_MESSAGES.inc(result="duplicate")
+                    continue
+                if len(self._tasks) >= self.config["ASGI_MAX_IN_FLIGHT"]:
+                    if message.id:
+                        await asyncio.to_thread(self.deduplicator.release, message.id)
+                    WEBHOOK_MESSAGES.inc(result="rejected")
+                    rejected += 1
+                    continue
+                self._spawn(self.process_message(message))
+                WEBHOOK_MESSAGES.inc(result="queued")
+
+            if rejected:
+                return 503, {"status": "error", "message": "Server busy"}, JSON
+            return 200, {"status": "ok"}, JSON
+        elif batch.statuses:
+            return 200, {"status": "ok"}, JSON
+        return 404, {"status": "error", "message": "Not a WhatsApp API event"}, JSON
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def process_message(self, message):
+        with log_context(message_id=message.id, wa_id=message.wa_id):
+            try:
+                if message.type == "text":
+                    await self.mailbox.post(message.wa_id, message.name, message.text)
+                elif message.type == "audio":
+                    await self.process_audio_message(message)
+                else:
+                    logger.info(f"Ignoring unsupported message type: {message.type}")
+            except Exception as e:
+                logger.error(f"Error processing message {message.id}: {e}")
+
+    async def process_audio_message(self, message):
+        """
+        The same dependency graph as process_whatsapp_audio_message: the read
+        receipt and the thread lookup/create run as tasks alongside the media
+        fetch and transcription, and the reply waits for the thread only.
+        """
+        logger.info(f"Incoming audio message {message.id} from wa_id {message.wa_id}")
+        if not message.media_id:
+            # Internal voice_file paths are a local testing aid of the Flask app
+            logger.error("Audio media id not found in the message")
+            return
+
+        if self.config["READ_RECEIPTS"]:
+            self._spawn(self.delivery.deliver(get_read_receipt_input(message.id, self.config["TYPING_INDICATOR"])))
+        conversation = self._spawn(self._prepare_conversation(message.wa_id, message.name))
+        transcription = await self.transcribe(message)
+        if transcription is None:
+            return
+
+        # The reply looks the thread up again; it just has to exist by now
+        await conversation
+        await self.mailbox.post(message.wa_id, message.name, transcription)
+
+    @staticmethod
+    async def _prepare_conversation(wa_id, name):
+        try:
+            await prepare_conversation_async(wa_id, name)
+        except Exception as e:
+            logger.warning(f"Failed to prepare the conversation of wa_id {wa_id}: {e}")
+
+    async def transcribe(self, message):
+        """
+        Transcription of a voice note, from the cache when possible. Returns
+        None if the media could not be fetched.
+        """
+        # The cache has a SQLite tier, so lookups run off the loop
+        cache_keys = [media_key(message.media_id)]
+        transcription = await asyncio.to_thread(self.transcription_cache.get, *cache_keys)
+        if transcription is None:
+            with track("media_url"):
+                response = await self.graph_client.get_media(message.media_id)
+            if response.status_code != 200:
+                logger.error(f"Failed to retrieve media URL: {response.status_code} {response.text}")
+                return None
+            media_data = response.json()
+            if not media_data.get("url"):
+                logger.error("Failed to retrieve audio URL")
+                return None
+
+            try:
+                with track("media_download"):
+                    media = await self.graph_client.download_media(
+                        media_data["url"],
+                        media_data.get("mime_type"),
+                        max_bytes=self.config["MEDIA_MAX_BYTES"],
+                        spool_max_bytes=self.config["MEDIA_SPOOL_BYTES"],
+                        headers=MEDIA_DOWNLOAD_HEADERS,
+                    )
+            except MediaError as e:
+                logger.error(f"Failed to download audio file: {e}")
+                return None
+            with media:
+                cache_keys.append(content_key(media.sha256))
+                transcription = await asyncio.to_thread(self.transcription_cache.get, cache_keys[-1])
+                if transcription is None:
+                    TRANSCRIPTION_CACHE_LOOKUPS.inc(result="miss")
+                    with track("transcribe"):
+                        transcription = await transcribe_audio_async(media, config=self.config)
+                else:
+                    TRANSCRIPTION_CACHE_LOOKUPS.inc(result="hit")
+            await asyncio.to_thread(self.transcription_cache.set, cache_keys, transcription)
+        else:
+            TRANSCRIPTION_CACHE_LOOKUPS.inc(result="hit")
+            logger.info("Using cached transcription")
+        return transcription
+
+    async def reply(self, wa_id, name, messages):
+        with track("reply"):
+            reply = AsyncSegmentedReply(wa_id, self.delivery, min_chars=self.config["REPLY_SEGMENT_MIN_CHARS"])
+            try:
+                if self.config["REPLY_STREAMING"]:
+                    await generate_response_async("\n".join(messages), wa_id, name, on_text=reply.feed)
+                else:
+                    response = await generate_response_async("\n".join(messages), wa_id, name)
+                    for segment in split_text(response):
+                        reply.send(segment)
+            except Exception:
+                # Let queued segments finish, but don't send one cut off mid-sentence
+                await reply.close(flush=False)
+                raise
+            await reply.close()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                # Let in-flight replies finish before closing the connection pool
+                if self._tasks:
+                    await asyncio.wait(set(self._tasks), timeout=30)
+                await self.graph_client.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+class AsyncSegmentedReply:
+    """
+    SegmentedReply for the event loop. `feed` is called from inside the
+    response stream, so sends are chained as tasks, each awaiting the one
+    before it, rather than awaited in place.
+    """
+
+    def __init__(self, wa_id, delivery, min_chars=200):
+        self.wa_id = wa_id
+        self.delivery = delivery
+        self._segmenter = ReplySegmenter(min_chars=min_chars)
+        self._last = None
+
+    def feed(self, text):
+        for segment in self._segmenter.feed(text):
+            self.send(segment)
+
+    def send(self, segment):
+        segment = process_text_for_whatsapp(segment)
+        if segment:
+            data = get_text_message_input(self.wa_id, segment)
+            self._last = asyncio.create_task(self._deliver_after(self._last, data))
+
+    async def _deliver_after(self, previous, data):
+        if previous is not None:
+            await asyncio.wait([previous])
+        # One failed segment must not stop the rest of the reply
+        try:
+            await self.delivery.deliver(data)
+        except Exception as e:
+            logger.error(f"Failed to send a reply segment to {self.wa_id}: {e}")
+
+    async def close(self, flush=True):
+        if flush:
+            for segment in self._segmenter.flush():
+                self.send(segment)
+        if self._last is not None:
+            await self._last
+
+
+def create_asgi_app(config=None):
+    """
+    Build the ASGI application. Without `config`, settings are read from the
+    environment exactly as create_app() does.
+    """
+    if config is None:
+        settings = SimpleNamespace(config={})
+        load_configurations(settings)
+        config = settings.config
+
+    # The local Whisper pool forks worker processes, which must happen
+    # before any background threads exist, including the log listener
+    if config["TRANSCRIPTION_PROVIDER"] == "whisper":
+        get_transcriber(config=config)
+
+    configure_logging()
+    return WebhookApp(config)
@@ -1,7 +1,19 @@
+import atexit
+import queue
 import sys
 import os
 from dotenv import load_dotenv
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from app.utils.logging_utils import (
+    ContextFilter,
+    JsonFormatter,
+    SamplingFilter,
+    TextFormatter,
+    TruncateFilter,
+    parse_levels,
+)
 
 
 def load_configurations(app):
@@ -17,14 +29,171 @@ def load_configurations(app):
     app.config["PHONE_NUMBER_ID"] = os.getenv("PHONE_NUMBER_ID")
     app.config["VERIFY_TOKEN"] = os.getenv("VERIFY_TOKEN")
     app.config["GEMINI_API_KEY"] = os.getenv("GEMINI_API_KEY")
+
+    # Transcription provider: "gemini" or "whisper" (local, loads torch on first use)
+    app.config["TRANSCRIPTION_PROVIDER"] = os.getenv("TRANSCRIPTION_PROVIDER", "gemini")
+    app.config["GEMINI_MODEL"] = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+    app.config["GEMINI_TIMEOUT"] = float(os.getenv("GEMINI_TIMEOUT", "30"))
+    # Alternative Gemini endpoint (REST transport), e.g. the offline benchmark stand-in
+    app.config["GEMINI_API_ENDPOINT"] = os.getenv("GEMINI_API_ENDPOINT") or None
+    # Inline requests are capped at 20 MB by the API; larger files are uploaded
+    app.config["GEMINI_INLINE_MAX_BYTES"] = int(os.getenv("GEMINI_INLINE_MAX_BYTES", str(15 * 1024 * 1024)))
+    app.config["WHISPER_MODEL"] = os.getenv("WHISPER_MODEL", "base")
+    app.config["WHISPER_PROCESSES"] = int(os.getenv("WHISPER_PROCESSES", "2"))
+    app.config["WHISPER_THREADS_PER_PROCESS"] = int(os.getenv("WHISPER_THREADS_PER_PROCESS", "1"))
+
+    # Transcription cache: in-memory LRU plus an optional SQLite tier
+    app.config["TRANSCRIPTION_CACHE_PATH"] = os.getenv("TRANSCRIPTION_CACHE_PATH", "transcriptions.sqlite3") or None
+    app.config["TRANSCRIPTION_CACHE_SIZE"] = int(os.getenv("TRANSCRIPTION_CACHE_SIZE", "2048"))
+    app.config["TRANSCRIPTION_CACHE_TTL"] = int(os.getenv("TRANSCRIPTION_CACHE_TTL", str(30 * 24 * 3600)))
+    app.config["TRANSCRIPTION_CACHE_MAX_BYTES"] = int(os.getenv("TRANSCRIPTION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+    # Media downloads: WhatsApp audio is at most 16 MB; smaller files stay in memory
+    app.config["MEDIA_MAX_BYTES"] = int(os.getenv("MEDIA_MAX_BYTES", str(16 * 1024 * 1024)))
+    app.config["MEDIA_SPOOL_BYTES"] = int(os.getenv("MEDIA_SPOOL_BYTES", str(1024 * 1024)))
+
+    # Graph API client
+    app.config["GRAPH_API_BASE_URL"] = os.getenv("GRAPH_API_BASE_URL", "https://graph.facebook.com")
+    app.config["GRAPH_POOL_SIZE"] = int(os.getenv("GRAPH_POOL_SIZE", os.getenv("WORKER_COUNT", "4")))
+    app.config["GRAPH_CONNECT_TIMEOUT"] = float(os.getenv("GRAPH_CONNECT_TIMEOUT", "3.05"))
+    app.config["GRAPH_READ_TIMEOUT"] = float(os.getenv("GRAPH_READ_TIMEOUT", "10"))
+    # Connection pool of the aiohttp client used by the ASGI entry point
+    app.config["GRAPH_ASYNC_POOL_SIZE"] = int(os.getenv("GRAPH_ASYNC_POOL_SIZE", "100"))
+
+    # Outbound delivery: WhatsApp Cloud API allows 80 messages/second per phone number by default
+    app.config["SEND_RATE_LIMIT"] = float(os.getenv("SEND_RATE_LIMIT", "80"))
+    app.config["SEND_RATE_BURST"] = int(os.getenv("SEND_RATE_BURST", "80"))
+    app.config["SEND_WORKERS"] = int(os.getenv("SEND_WORKERS", "8"))
+    app.config["SEND_MAX_RETRIES"] = int(os.getenv("SEND_MAX_RETRIES", "5"))
+    app.config["SEND_DEAD_LETTER_PATH"] = os.getenv("SEND_DEAD_LETTER_PATH", "dead_letters.jsonl")
+
+    # Mark voice notes as read and show "typing…" while they are transcribed and answered
+    app.config["READ_RECEIPTS"] = os.getenv("READ_RECEIPTS", "true").lower() in ["true", "1", "t"]
+    app.config["TYPING_INDICATOR"] = os.getenv("TYPING_INDICATOR", "true").lower() in ["true", "1", "t"]
+
+    # Send replies in segments as they are generated instead of once complete
+    app.config["REPLY_STREAMING"] = os.getenv("REPLY_STREAMING", "false").lower() in ["true", "1", "t"]
+    app.config["REPLY_SEGMENT_MIN_CHARS"] = int(os.getenv("REPLY_SEGMENT_MIN_CHARS", "200"))
+
+    # Per-user mailbox: messages arriving within the debounce window share one reply
+    app.config["MESSAGE_DEBOUNCE_MS"] = float(os.getenv("MESSAGE_DEBOUNCE_MS", "200"))
+    app.config["MESSAGE_MAX_BATCH"] = int(os.getenv("MESSAGE_MAX_BATCH", "10"))
+
+    # Webhook deduplication by message id
+    app.config["DEDUP_DB_PATH"] = os.getenv("DEDUP_DB_PATH", "processed_messages.sqlite3") or None
+    app.config["DEDUP_TTL"] = int(os.getenv("DEDUP_TTL", str(24 * 3600)))
+
+    # Answer cache: curated FAQ answers, plus context-free answers to questions
+    # that ANSWER_CACHE_MIN_USERS different users asked (0 serves the FAQ only)
+    app.config["ANSWER_CACHE_ENABLED"] = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() in ["true", "1", "t"]
+    app.config["ANSWER_CACHE_FAQ_FILE"] = os.getenv("ANSWER_CACHE_FAQ_FILE") or None
+    app.config["ANSWER_CACHE_MIN_USERS"] = int(os.getenv("ANSWER_CACHE_MIN_USERS", "3"))
+    app.config["ANSWER_CACHE_SIZE"] = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+    app.config["ANSWER_CACHE_TTL"] = int(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+    app.config["ANSWER_CACHE_SIMILARITY"] = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+    # Still record cached exchanges in the user's thread or history, in the background
+    app.config["ANSWER_CACHE_APPEND_TO_THREAD"] = (
+        os.getenv("ANSWER_CACHE_APPEND_TO_THREAD", "false").lower() in ["true", "1", "t"]
+    )
+
+    # Local knowledge retrieval: BM25 over KNOWLEDGE_DIR, passages added to each reply
+    app.config["RETRIEVAL_ENABLED"] = os.getenv("RETRIEVAL_ENABLED", "false").lower() in ["true", "1", "t"]
+    app.config["KNOWLEDGE_DIR"] = os.getenv("KNOWLEDGE_DIR", "data")
+    app.config["KNOWLEDGE_INDEX_DIR"] = os.getenv("KNOWLEDGE_INDEX_DIR", "knowledge_index")
+    app.config["RETRIEVAL_TOP_K"] = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+    app.config["RETRIEVAL_MAX_CHARS"] = int(os.getenv("RETRIEVAL_MAX_CHARS", "3000"))
+
+    # Response engine: "assistants" (threads and runs) or "chat" (chat_engine:
+    # local history, one completion per reply)
+    app.config["RESPONSE_ENGINE"] = os.getenv("RESPONSE_ENGINE", "assistants").lower()
+    app.config["ASSISTANT_RUN_TIMEOUT"] = float(os.getenv("ASSISTANT_RUN_TIMEOUT", "60"))
+    app.config["ASSISTANT_RUN_STREAMING"] = os.getenv("ASSISTANT_RUN_STREAMING", "true").lower() in ["true", "1", "t"]
+    app.config["METADATA_CACHE_TTL"] = int(os.getenv("METADATA_CACHE_TTL", "3600"))
+    app.config["CHAT_MODEL"] = os.getenv("CHAT_MODEL", "gpt-4o-mini")
+    app.config["CHAT_TIMEOUT"] = float(os.getenv("CHAT_TIMEOUT", "60"))
+
+    # Conversation state: each wa_id's OpenAI thread (assistants engine), with
+    # the shelve file it was once kept in, and recent turns (chat engine)
+    app.config["CONVERSATION_DB"] = os.getenv("CONVERSATION_DB", "threads.sqlite3")
+    app.config["LEGACY_THREADS_DB"] = os.getenv("LEGACY_THREADS_DB", "threads_db")
+    app.config["CONVERSATION_CACHE_SIZE"] = int(os.getenv("CONVERSATION_CACHE_SIZE", "10000"))
+    app.config["CONVERSATION_CACHE_TTL"] = int(os.getenv("CONVERSATION_CACHE_TTL", "300"))
+    app.config["HISTORY_DB"] = os.getenv("HISTORY_DB", "history.sqlite3")
+    app.config["CHAT_HISTORY_TURNS"] = int(os.getenv("CHAT_HISTORY_TURNS", "10"))
+    # Threads past either limit are summarized and rotated (0 disables a limit)
+    app.config["THREAD_MAX_MESSAGES"] = int(os.getenv("THREAD_MAX_MESSAGES", "40"))
+    app.config["THREAD_MAX_TOKENS"] = int(os.getenv("THREAD_MAX_TOKENS", "8000"))
+    app.config["THREAD_SUMMARY_MODEL"] = os.getenv("THREAD_SUMMARY_MODEL", "gpt-4o-mini")
+
+    # Background processing of webhook events
+    app.config["WORKER_COUNT"] = int(os.getenv("WORKER_COUNT", "4"))
+    app.config["JOB_QUEUE_MAXSIZE"] = int(os.getenv("JOB_QUEUE_MAXSIZE", "1000"))
+    app.config["JOB_QUEUE_PATH"] = os.getenv("JOB_QUEUE_PATH") or None
+    # ASGI entry point: messages processed concurrently before answering 503
+    app.config["ASGI_MAX_IN_FLIGHT"] = int(os.getenv("ASGI_MAX_IN_FLIGHT", "5000"))
+
+    # Bearer token required by /metrics; leave empty to serve it unauthenticated
+    app.config["METRICS_TOKEN"] = os.getenv("METRICS_TOKEN", "")
     
     # Set debug mode based on environment
     app.config["DEBUG"] = os.getenv("FLASK_DEBUG", "false").lower() in ["true", "1", "t"]
 
+_log_listener = None
+
+
+def _stop_log_listener():
+    if _log_listener is not None:
+        _log_listener.stop()
+
+
 def configure_logging():
-    log_level = logging.DEBUG if os.getenv("FLASK_DEBUG", "false").lower() in ["true", "1", "t"] else logging.INFO
-    logging.basicConfig(
-        level=log_level,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        stream=sys.stdout,
-    )
+    """
+    Route all logging through a queue so request and worker threads never
+    block on I/O: records are filtered, truncated and tagged with the bound
+    request/message ids in the calling thread, then a background listener
+    formats them (JSON by default) and writes to stdout and, optionally, a
+    rotating log file.
+    """
+    global _log_listener
+
+    debug = os.getenv("FLASK_DEBUG", "false").lower() in ["true", "1", "t"]
+    log_level = os.getenv("LOG_LEVEL", "DEBUG" if debug else "INFO").upper()
+    formatter = JsonFormatter() if os.getenv("LOG_FORMAT", "json").lower() == "json" else TextFormatter()
+
+    handlers = [logging.StreamHandler(sys.stdout)]
+    log_file = os.getenv("LOG_FILE")
+    if log_file:
+        os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+        handlers.append(RotatingFileHandler(log_file, maxBytes=10 * 1024 * 1024, backupCount=10))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))))
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(TruncateFilter(int(os.getenv("LOG_MAX_MESSAGE_LENGTH", "1000"))))
+
+    # Replace whatever a previous call (or basicConfig) installed
+    first_call = _log_listener is None
+    _stop_log_listener()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(log_level)
+
+    # Per-module levels, e.g. LOG_LEVELS="app.views=WARNING,app.services.openai_service=DEBUG"
+    for name, level in parse_levels(os.getenv("LOG_LEVELS")).items():
+        logging.getLogger(name).setLevel(level)
+    # Chatty third-party loggers
+    for name in ("urllib3", "httpx", "openai"):
+        if name not in parse_levels(os.getenv("LOG_LEVELS")):
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+    _log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    if first_call:
+        # Stops whichever listener is current at exit, so repeated calls
+        # (one per create_app) do not pile up hooks for stopped listeners
+        atexit.register(_stop_log_listener)
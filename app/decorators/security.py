@@ -1,18 +1,29 @@
-from functools import wraps
-from flask import current_app, jsonify, request
+from functools import lru_cache, wraps
+from flask import current_app, g, jsonify, request
 import logging
 import hashlib
 import hmac
 
+from app.utils.json_utils import loads
 
-def validate_signature(payload, signature):
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=4)
+def signing_key(app_secret):
+    return bytes(app_secret, "latin-1")
+
+
+def validate_signature(payload, signature, app_secret=None):
     """
-    Validate the incoming payload's signature against our expected signature
+    Validate the incoming payload's signature against our expected signature.
+    The payload is the raw request body as bytes, exactly as Meta signed it.
+    Outside a Flask app (the ASGI entry point) the secret is passed in.
     """
     # Use the App Secret to hash the payload
     expected_signature = hmac.new(
-        bytes(current_app.config["APP_SECRET"], "latin-1"),
-        msg=payload.encode("utf-8"),
+        signing_key(app_secret or current_app.config["APP_SECRET"]),
+        msg=payload,
         digestmod=hashlib.sha256,
     ).hexdigest()
 
@@ -23,6 +34,7 @@ def validate_signature(payload, signature):
 def signature_required(f):
     """
     Decorator to ensure that the incoming requests to our webhook are valid and signed with the correct signature.
+    The verified body is parsed once and left on `g.webhook_body` for the view.
     """
 
     @wraps(f)
@@ -30,9 +42,15 @@ def signature_required(f):
         signature = request.headers.get("X-Hub-Signature-256", "")[
             7:
         ]  # Removing 'sha256='
-        if not validate_signature(request.data.decode("utf-8"), signature):
-            logging.info("Signature verification failed!")
+        payload = request.get_data(cache=True)
+        if not validate_signature(payload, signature):
+            logger.info("Signature verification failed!")
             return jsonify({"status": "error", "message": "Invalid signature"}), 403
+        try:
+            g.webhook_body = loads(payload)
+        except ValueError:
+            logger.error("Failed to decode JSON")
+            return jsonify({"status": "error", "message": "Invalid JSON provided"}), 400
         return f(*args, **kwargs)
 
     return decorated_function
@@ -0,0 +1,183 @@
+import json
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from itertools import islice
+
+from app.utils.metrics import registry
+from app.utils.text_utils import ngrams, normalize_text
+
+ANSWER_CACHE_LOOKUPS = registry.counter(
+    "zowobo_answer_cache_total", "Answer cache lookups by result (hit, similar, miss).", ("result",)
+)
+ANSWER_CACHE_ENTRIES = registry.gauge("zowobo_answer_cache_entries", "Answers currently cached.")
+
+
+class AnswerCache:
+    """
+    Answers to frequent questions, keyed on normalized message text.
+
+    Exact matches are a dict lookup. With `similarity` > 0, a miss falls back
+    to the cached question with the highest character n-gram Jaccard
+    similarity, if it reaches the threshold; an inverted n-gram index keeps
+    that to the questions sharing at least one n-gram. Entries expire after
+    `ttl` seconds and the least recently used are evicted beyond `maxsize`.
+    Only questions between `min_chars` and `max_chars` (normalized) are
+    cached, since short replies like "wi" or long messages depend on context.
+
+    A reply generated in a user's own conversation may mention their name
+    or details of it, so it is never stored here. Entries are either the
+    curated `faq` (question, answer) pairs, which do not expire, or answers
+    generated without any conversation context for questions that
+    `min_users` different users have asked (see popular()).
+    """
+
+    def __init__(
+        self,
+        maxsize=1000,
+        ttl=24 * 3600,
+        similarity=0.0,
+        ngram=3,
+        min_chars=8,
+        max_chars=200,
+        min_users=3,
+        faq=None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.similarity = similarity
+        self.ngram = ngram
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.min_users = min_users
+        self._entries = OrderedDict()
+        self._index = {}
+        self._faq = set()
+        # Users who asked each not yet cached question, least recent first
+        self._askers = OrderedDict()
+        self._lock = threading.Lock()
+        for question, answer in faq or ():
+            key = normalize_text(question)
+            self._faq.add(key)
+            self._insert(key, answer, math.inf)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def cacheable(self, key):
+        return self.min_chars <= len(key) <= self.max_chars
+
+    def get(self, text):
+        key = normalize_text(text)
+        if not self.cacheable(key) and key not in self._faq:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            answer = self._lookup(key, now)
+            result = "hit"
+            if answer is None and self.similarity > 0:
+                match = self._most_similar(key, now)
+                if match is not None:
+                    answer = self._lookup(match, now)
+                    result = "similar"
+        ANSWER_CACHE_LOOKUPS.inc(result=result if answer is not None else "miss")
+        return answer
+
+    def popular(self, text, wa_id):
+        """
+        Note that `wa_id` asked `text`. True exactly once, when `min_users`
+        different users have asked it and it is not cached yet: the caller
+        should then generate a context-free answer and set() it.
+        """
+        key = normalize_text(text)
+        if self.min_users <= 0 or not self.cacheable(key):
+            return False
+        with self._lock:
+            if key in self._entries:
+                return False
+            askers = self._askers.pop(key, set())
+            askers.add(wa_id)
+            if len(askers) >= self.min_users:
+                return True
+            self._askers[key] = askers
+            while len(self._askers) > self.maxsize:
+                self._askers.popitem(last=False)
+        return False
+
+    def set(self, text, answer):
+        """
+        Cache `answer`, which must not depend on any user's conversation.
+        """
+        key = normalize_text(text)
+        if not self.cacheable(key) or not answer:
+            return
+        with self._lock:
+            if key not in self._faq:
+                self._insert(key, answer, time.monotonic() + self.ttl)
+
+    def clear(self):
+        """
+        Drop generated answers; the curated FAQ stays.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key not in self._faq]:
+                self._remove(key)
+            self._askers.clear()
+
+    def _insert(self, key, answer, expires_at):
+        grams = ngrams(key, self.ngram) if self.similarity > 0 else frozenset()
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (answer, expires_at, grams)
+        for gram in grams:
+            self._index.setdefault(gram, set()).add(key)
+        # Evict the least recently used generated answers, never the FAQ
+        excess = len(self._entries) - len(self._faq) - self.maxsize
+        if excess > 0:
+            for old in list(islice((old for old in self._entries if old not in self._faq), excess)):
+                self._remove(old)
+
+    def _lookup(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        answer, expires_at, _ = entry
+        if expires_at < now:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return answer
+
+    def _most_similar(self, key, now):
+        grams = ngrams(key, self.ngram)
+        overlaps = Counter()
+        for gram in grams:
+            overlaps.update(self._index.get(gram, ()))
+
+        best, best_score = None, self.similarity
+        for candidate, overlap in overlaps.items():
+            candidate_grams = self._entries[candidate][2]
+            score = overlap / (len(grams) + len(candidate_grams) - overlap)
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def _remove(self, key):
+        _, _, grams = self._entries.pop(key)
+        for gram in grams:
+            keys = self._index.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[gram]
+
+
+def load_faq(path):
+    """
+    Curated (question, answer) pairs from a JSON file holding a list of
+    {"question": ..., "answer": ...} objects.
+    """
+    with open(path, encoding="utf-8") as f:
+        return [(entry["question"], entry["answer"]) for entry in json.load(f)]
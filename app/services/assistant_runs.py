@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import time
+
+from openai import APIConnectionError, APIStatusError
+
+logger = logging.getLogger(__name__)
+
+
+class RunError(Exception):
+    """
+    Raised when an Assistants run does not complete with a reply.
+    """
+
+    def __init__(self, status, message=""):
+        super().__init__(f"Run ended with status '{status}' {message}".strip())
+        self.status = status
+
+
+class _StreamUnavailable(Exception):
+    pass
+
+
+ACTIVE_STATES = {"queued", "in_progress", "cancelling"}
+FAILED_STATES = {"failed", "expired", "cancelled", "incomplete"}
+
+
+def poll_delays(initial=0.15, factor=1.6, cap=2.0):
+    """
+    Yield sleep intervals for polling: quick checks first, since most short
+    replies finish within a second, then back off up to the cap.
+    """
+    delay = initial
+    while True:
+        yield delay
+        delay = min(delay * factor, cap)
+
+
+def wait_for_run(client, thread_id, assistant_id, timeout=60, stream=True, on_text=None, **run_kwargs):
+    """
+    Start a run on the thread and return the assistant's reply text.
+    Uses the streaming run API when enabled, so the reply arrives as soon as
+    the run finishes, and falls back to adaptive polling otherwise.
+    `on_text`, if given, is called with each piece of the reply as it is
+    generated (with the whole reply at once when polling).
+    """
+    deadline = time.monotonic() + timeout
+    if stream:
+        try:
+            return _stream_run(client, thread_id, assistant_id, deadline, on_text, **run_kwargs)
+        except _StreamUnavailable as e:
+            logger.warning(f"Run streaming unavailable, falling back to polling: {e}")
+    reply = _poll_run(client, thread_id, assistant_id, deadline, **run_kwargs)
+    if on_text is not None:
+        on_text(reply)
+    return reply
+
+
+def _text_deltas(event):
+    if event.event != "thread.message.delta":
+        return []
+    return [
+        block.text.value
+        for block in event.data.delta.content or ()
+        if block.type == "text" and block.text is not None and block.text.value
+    ]
+
+
+def _stream_run(client, thread_id, assistant_id, deadline, on_text=None, **run_kwargs):
+    run = None
+    streamed = False
+    try:
+        with client.beta.threads.runs.stream(
+            thread_id=thread_id,
+            assistant_id=assistant_id,
+            timeout=max(deadline - time.monotonic(), 1),
+            **run_kwargs,
+        ) as stream:
+            for event in stream:
+                run = stream.current_run or run
+                if on_text is not None:
+                    for text in _text_deltas(event):
+                        on_text(text)
+                        streamed = True
+                if event.event == "thread.run.requires_action":
+                    _cancel(client, thread_id, run.id)
+                    raise RunError(run.status, "(tool calls are not supported)")
+                if time.monotonic() > deadline:
+                    if run is not None:
+                        _cancel(client, thread_id, run.id)
+                    raise RunError("expired", "(deadline exceeded while streaming)")
+            run = stream.get_final_run()
+            messages = stream.get_final_messages()
+    except (APIConnectionError, APIStatusError) as e:
+        # Only safe to retry by polling if no run was created yet
+        if run is None:
+            raise _StreamUnavailable(e) from e
+        raise
+
+    if run.status != "completed":
+        raise RunError(run.status, _describe_error(run))
+    reply = messages[-1].content[0].text.value if messages else _latest_reply(client, thread_id, run.id)
+    if on_text is not None and not streamed:
+        on_text(reply)
+    return reply
+
+
+def _poll_run(client, thread_id, assistant_id, deadline, **run_kwargs):
+    run = client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id, **run_kwargs)
+
+    delays = poll_delays()
+    while run.status in ACTIVE_STATES:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            _cancel(client, thread_id, run.id)
+            raise RunError("expired", "(deadline exceeded while polling)")
+        time.sleep(min(next(delays), remaining))
+        run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+        logger.debug(f"Run {run.id} status: {run.status}")
+
+    if run.status == "requires_action":
+        _cancel(client, thread_id, run.id)
+        raise RunError(run.status, "(tool calls are not supported)")
+    if run.status in FAILED_STATES:
+        raise RunError(run.status, _describe_error(run))
+
+    return _latest_reply(client, thread_id, run.id)
+
+
+async def wait_for_run_async(client, thread_id, assistant_id, timeout=60, stream=True, on_text=None, **run_kwargs):
+    """
+    wait_for_run for an AsyncOpenAI client: the event loop is free while the
+    run is in progress, so one process can wait on many runs at once.
+    """
+    deadline = time.monotonic() + timeout
+    if stream:
+        try:
+            return await _stream_run_async(client, thread_id, assistant_id, deadline, on_text, **run_kwargs)
+        except _StreamUnavailable as e:
+            logger.warning(f"Run streaming unavailable, falling back to polling: {e}")
+    reply = await _poll_run_async(client, thread_id, assistant_id, deadline, **run_kwargs)
+    if on_text is not None:
+        on_text(reply)
+    return reply
+
+
+async def _stream_run_async(client, thread_id, assistant_id, deadline, on_text=None, **run_kwargs):
+    run = None
+    streamed = False
+    try:
+        async with client.beta.threads.runs.stream(
+            thread_id=thread_id,
+            assistant_id=assistant_id,
+            timeout=max(deadline - time.monotonic(), 1),
+            **run_kwargs,
+        ) as stream:
+            async for event in stream:
+                run = stream.current_run or run
+                if on_text is not None:
+                    for text in _text_deltas(event):
+                        on_text(text)
+                        streamed = True
+                if event.event == "thread.run.requires_action":
+                    await _cancel_async(client, thread_id, run.id)
+                    raise RunError(run.status, "(tool calls are not supported)")
+                if time.monotonic() > deadline:
+                    if run is not None:
+                        await _cancel_async(client, thread_id, run.id)
+                    raise RunError("expired", "(deadline exceeded while streaming)")
+            run = await stream.get_final_run()
+            messages = await stream.get_final_messages()
+    except (APIConnectionError, APIStatusError) as e:
+        if run is None:
+            raise _StreamUnavailable(e) from e
+        raise
+
+    if run.status != "completed":
+        raise RunError(run.status, _describe_error(run))
+    reply = messages[-1].content[0].text.value if messages else await _latest_reply_async(client, thread_id, run.id)
+    if on_text is not None and not streamed:
+        on_text(reply)
+    return reply
+
+
+async def _poll_run_async(client, thread_id, assistant_id, deadline, **run_kwargs):
+    run = await client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id, **run_kwargs)
+
+    delays = poll_delays()
+    while run.status in ACTIVE_STATES:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            await _cancel_async(client, thread_id, run.id)
+            raise RunError("expired", "(deadline exceeded while polling)")
+        await asyncio.sleep(min(next(delays), remaining))
+        run = await client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+        logger.debug(f"Run {run.id} status: {run.status}")
+
+    if run.status == "requires_action":
+        await _cancel_async(client, thread_id, run.id)
+        raise RunError(run.status, "(tool calls are not supported)")
+    if run.status in FAILED_STATES:
+        raise RunError(run.status, _describe_error(run))
+
+    return await _latest_reply_async(client, thread_id, run.id)
+
+
+def _latest_reply(client, thread_id, run_id):
+    messages = client.beta.threads.messages.list(thread_id=thread_id, run_id=run_id, limit=1)
+    return messages.data[0].content[0].text.value
+
+
+async def _latest_reply_async(client, thread_id, run_id):
+    messages = await client.beta.threads.messages.list(thread_id=thread_id, run_id=run_id, limit=1)
+    return messages.data[0].content[0].text.value
+
+
+def _cancel(client, thread_id, run_id):
+    try:
+        client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception as e:
+        logger.warning(f"Failed to cancel run {run_id}: {e}")
+
+
+async def _cancel_async(client, thread_id, run_id):
+    try:
+        await client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception as e:
+        logger.warning(f"Failed to cancel run {run_id}: {e}")
+
+
+def _describe_error(run):
+    if run.last_error:
+        return f"({run.last_error.code}: {run.last_error.message})"
+    if run.incomplete_details:
+        return f"({run.incomplete_details.reason})"
+    return ""
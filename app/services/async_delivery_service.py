@@ -0,0 +1,67 @@
+import asyncio
+import logging
+
+import aiohttp
+
+from app.services.delivery_service import (
+    DELIVERIES,
+    RETRYABLE_STATUS_CODES,
+    SEND_RETRIES,
+    BaseDeliveryService,
+    log_http_response,
+)
+from app.utils.metrics import track
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDeliveryService(BaseDeliveryService):
+    """
+    DeliveryService for the ASGI entry point: same rate limits, retries and
+    dead letters, on an AsyncGraphClient, with no threads.
+    """
+
+    async def deliver(self, data):
+        bucket = self._bucket(self.graph_client.phone_number_id)
+        error = None
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire_async()
+            retry_after = None
+            try:
+                with track("graph_send"):
+                    response = await self.graph_client.send_message(data)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+                # As in DeliveryService, retry only when the request never got through
+                if not isinstance(e, (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError)):
+                    break
+                logger.warning(f"Sending message failed (attempt {attempt + 1}): {error}")
+            else:
+                if response.ok:
+                    log_http_response(response)
+                    DELIVERIES.inc(result="sent")
+                    return response
+                error = f"{response.status_code} {response.text}"
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    break
+                logger.warning(f"Sending message failed (attempt {attempt + 1}): {error}")
+                retry_after = response.headers.get("Retry-After")
+
+            if attempt < self.max_retries:
+                SEND_RETRIES.inc()
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+
+        DELIVERIES.inc(result="dead_letter")
+        # File I/O, so off the event loop
+        await asyncio.to_thread(self._dead_letter, data, error)
+        return None
+
+
+def create_async_delivery_service(graph_client, config):
+    return AsyncDeliveryService(
+        graph_client,
+        rate=config["SEND_RATE_LIMIT"],
+        burst=config["SEND_RATE_BURST"],
+        max_retries=config["SEND_MAX_RETRIES"],
+        dead_letter_path=config["SEND_DEAD_LETTER_PATH"],
+    )
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import logging
+
+import aiohttp
+
+from app.services.media_service import MediaError, MediaFile, MediaTooLarge
+
+logger = logging.getLogger(__name__)
+
+
+class GraphResponse:
+    """
+    The parts of a Graph API response the delivery code needs, read eagerly
+    so the connection goes back to the pool. Mirrors requests.Response.
+    """
+
+    __slots__ = ("status_code", "headers", "text")
+
+    def __init__(self, status_code, headers, text):
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AsyncGraphClient:
+    """
+    aiohttp counterpart of GraphClient for the ASGI entry point. One session
+    and connection pool per event loop, created on first use.
+    """
+
+    def __init__(
+        self,
+        access_token,
+        version,
+        phone_number_id,
+        base_url="https://graph.facebook.com",
+        pool_size=100,
+        timeout=(3.05, 10),
+    ):
+        self.phone_number_id = phone_number_id
+        self.base_url = f"{base_url.rstrip('/')}/{version}"
+        self.messages_url = f"{self.base_url}/{phone_number_id}/messages"
+        self.auth_headers = {"Authorization": f"Bearer {access_token}"}
+        self.json_headers = {**self.auth_headers, "Content-type": "application/json"}
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def _request(self, method, url, **kwargs):
+        async with self.session.request(method, url, **kwargs) as response:
+            return GraphResponse(response.status, response.headers, await response.text())
+
+    async def send_message(self, data):
+        return await self._request("POST", self.messages_url, data=data, headers=self.json_headers)
+
+    async def get_media(self, media_id):
+        return await self._request("GET", f"{self.base_url}/{media_id}", headers=self.auth_headers)
+
+    async def download_media(self, url, mime_type, max_bytes, spool_max_bytes, headers=None):
+        """
+        Async download_media: stream a media URL into a MediaFile with the same
+        size limits. Raises MediaError on failure.
+        """
+        try:
+            async with self.session.get(url, headers={**self.auth_headers, **(headers or {})}) as response:
+                if response.status != 200:
+                    body = await response.text()
+                    raise MediaError(f"Failed to download media: {response.status} {body[:500]}")
+
+                if response.content_length is not None and response.content_length > max_bytes:
+                    raise MediaTooLarge(f"Media is {response.content_length} bytes, limit is {max_bytes}")
+
+                media = MediaFile(mime_type or response.content_type, spool_max_bytes, max_bytes)
+                try:
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        media.write(chunk)
+                except BaseException:
+                    media.close()
+                    raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise MediaError(f"Request to download media failed: {e}") from e
+
+        logger.info(f"Downloaded {media.size} bytes of {media.mime_type}")
+        return media
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def create_async_graph_client(config):
+    return AsyncGraphClient(
+        access_token=config["ACCESS_TOKEN"],
+        version=config["VERSION"],
+        phone_number_id=config["PHONE_NUMBER_ID"],
+        base_url=config["GRAPH_API_BASE_URL"],
+        pool_size=config["GRAPH_ASYNC_POOL_SIZE"],
+        timeout=(config["GRAPH_CONNECT_TIMEOUT"], config["GRAPH_READ_TIMEOUT"]),
+    )
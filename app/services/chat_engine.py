@@ -0,0 +1,133 @@
+import asyncio
+import logging
+
+from flask import current_app
+
+from app.services.history_store import get_history_store
+from app.services.openai_service import (
+    ZOWOBO_INSTRUCTIONS,
+    async_client,
+    client,
+    retrieval_instructions,
+)
+from app.utils.metrics import track
+
+logger = logging.getLogger(__name__)
+
+# Response engine selected with RESPONSE_ENGINE=chat. Instead of a thread,
+# a message, a run and a message list on the Assistants API, each reply is
+# one streaming chat completion over the last CHAT_HISTORY_TURNS exchanges,
+# which are kept locally.
+
+
+def build_messages(history, message_body):
+    messages = [{"role": "system", "content": ZOWOBO_INSTRUCTIONS}]
+    instructions = retrieval_instructions(message_body)
+    if instructions:
+        messages.append({"role": "system", "content": instructions})
+    messages.extend(history)
+    messages.append({"role": "user", "content": message_body})
+    return messages
+
+
+def record_exchange(wa_id, message_body, reply):
+    if reply:
+        get_history_store().append(
+            wa_id, [{"role": "user", "content": message_body}, {"role": "assistant", "content": reply}]
+        )
+
+
+def _delta(chunk):
+    return chunk.choices[0].delta.content if chunk.choices else None
+
+
+def stream_response(message_body, wa_id, name):
+    """
+    Yield the reply to `message_body` piece by piece as the model writes it.
+    The exchange is added to the user's history once the reply is complete.
+    """
+    with track("history_lookup"):
+        history = get_history_store().get(wa_id)
+
+    parts = []
+    with track("chat_completion"):
+        with client.chat.completions.create(
+            model=current_app.config["CHAT_MODEL"],
+            messages=build_messages(history, message_body),
+            stream=True,
+            timeout=current_app.config["CHAT_TIMEOUT"],
+        ) as stream:
+            for chunk in stream:
+                text = _delta(chunk)
+                if text:
+                    parts.append(text)
+                    yield text
+
+    reply = "".join(parts)
+    logger.debug("Generated message: %s", reply)
+    record_exchange(wa_id, message_body, reply)
+
+
+def generate_response(message_body, wa_id, name, on_text=None):
+    parts = []
+    for text in stream_response(message_body, wa_id, name):
+        if on_text is not None:
+            on_text(text)
+        parts.append(text)
+    return "".join(parts)
+
+
+async def stream_response_async(message_body, wa_id, name):
+    with track("history_lookup"):
+        history = await asyncio.to_thread(get_history_store().get, wa_id)
+
+    parts = []
+    with track("chat_completion"):
+        async with await async_client.chat.completions.create(
+            model=current_app.config["CHAT_MODEL"],
+            messages=build_messages(history, message_body),
+            stream=True,
+            timeout=current_app.config["CHAT_TIMEOUT"],
+        ) as stream:
+            async for chunk in stream:
+                text = _delta(chunk)
+                if text:
+                    parts.append(text)
+                    yield text
+
+    reply = "".join(parts)
+    logger.debug("Generated message: %s", reply)
+    await asyncio.to_thread(record_exchange, wa_id, message_body, reply)
+
+
+async def generate_response_async(message_body, wa_id, name, on_text=None):
+    parts = []
+    async for text in stream_response_async(message_body, wa_id, name):
+        if on_text is not None:
+            on_text(text)
+        parts.append(text)
+    return "".join(parts)
+
+
+def generate_shared_answer(message_body):
+    """
+    Answer `message_body` with no conversation history, so the answer holds
+    nothing specific to one user and can be shared through the answer cache.
+    """
+    with track("shared_answer"):
+        completion = client.chat.completions.create(
+            model=current_app.config["CHAT_MODEL"],
+            messages=build_messages([], message_body),
+            timeout=current_app.config["CHAT_TIMEOUT"],
+        )
+    return completion.choices[0].message.content
+
+
+async def generate_shared_answer_async(message_body):
+    with track("shared_answer"):
+        completion = await async_client.chat.completions.create(
+            model=current_app.config["CHAT_MODEL"],
+            messages=build_messages([], message_body),
+            timeout=current_app.config["CHAT_TIMEOUT"],
+        )
+    return completion.choices[0].message.content
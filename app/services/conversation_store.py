@@ -0,0 +1,188 @@
+import logging
+import os
+import shelve
+import threading
+from abc import ABC, abstractmethod
+
+from flask import current_app
+
+from app.utils.cache import LRUCache
+from app.utils.sqlite_utils import connect
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationStore(ABC):
+    """
+    Maps a WhatsApp id (wa_id) to the OpenAI thread holding its conversation,
+    and tracks how large each thread has grown so it can be rotated.
+    """
+
+    @abstractmethod
+    def get_thread(self, wa_id):
+        pass
+
+    @abstractmethod
+    def set_thread(self, wa_id, thread_id):
+        pass
+
+    @abstractmethod
+    def add_usage(self, thread_id, messages, tokens):
+        """
+        Count messages added to a thread; returns the new (messages, tokens) totals.
+        """
+
+    @abstractmethod
+    def get_usage(self, thread_id):
+        """
+        Return (messages, tokens, summary, summary_messages) for a thread, or
+        None if nothing was recorded. `summary` covers the first
+        `summary_messages` messages.
+        """
+
+    @abstractmethod
+    def set_summary(self, thread_id, summary, messages):
+        pass
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    SQLite backend in WAL mode, safe to share between gunicorn workers.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS threads (wa_id TEXT PRIMARY KEY, thread_id TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS thread_usage ("
+            "thread_id TEXT PRIMARY KEY, messages INTEGER NOT NULL DEFAULT 0, tokens INTEGER NOT NULL DEFAULT 0, "
+            "summary TEXT, summary_messages INTEGER)"
+        )
+
+    def get_thread(self, wa_id):
+        with self._lock:
+            row = self._conn.execute("SELECT thread_id FROM threads WHERE wa_id = ?", (wa_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_thread(self, wa_id, thread_id):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO threads (wa_id, thread_id) VALUES (?, ?) "
+                "ON CONFLICT(wa_id) DO UPDATE SET thread_id = excluded.thread_id",
+                (wa_id, thread_id),
+            )
+
+    def add_usage(self, thread_id, messages, tokens):
+        with self._lock:
+            # No RETURNING (SQLite 3.35+): the write lock taken by BEGIN IMMEDIATE
+            # keeps other processes from updating the row before it is read back
+            self._conn.execute("BEGIN IMMEDIATE")
+            # Commits, or rolls back if a statement fails
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO thread_usage (thread_id, messages, tokens) VALUES (?, 0, 0)", (thread_id,)
+                )
+                self._conn.execute(
+                    "UPDATE thread_usage SET messages = messages + ?, tokens = tokens + ? WHERE thread_id = ?",
+                    (messages, tokens, thread_id),
+                )
+                return self._conn.execute(
+                    "SELECT messages, tokens FROM thread_usage WHERE thread_id = ?", (thread_id,)
+                ).fetchone()
+
+    def get_usage(self, thread_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT messages, tokens, summary, summary_messages FROM thread_usage WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+
+    def set_summary(self, thread_id, summary, messages):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE thread_usage SET summary = ?, summary_messages = ? WHERE thread_id = ?",
+                (summary, messages, thread_id),
+            )
+
+    def migrate_shelve(self, shelve_path):
+        """
+        One-shot import of the legacy shelve files (threads_db.dat/.dir/.bak).
+        Existing rows win, so running it again never overwrites newer threads.
+        """
+        with self._lock:
+            done = self._conn.execute("SELECT value FROM meta WHERE key = 'shelve_migrated'").fetchone()
+        if done or not os.path.exists(f"{shelve_path}.dat"):
+            return 0
+
+        with shelve.open(shelve_path, flag="r") as threads_shelf:
+            rows = [(wa_id, thread_id) for wa_id, thread_id in threads_shelf.items()]
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR IGNORE INTO threads (wa_id, thread_id) VALUES (?, ?)", rows)
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('shelve_migrated', ?)", (shelve_path,))
+            self._conn.execute("COMMIT")
+        logger.info(f"Migrated {len(rows)} threads from {shelve_path} to {self.path}")
+        return len(rows)
+
+
+class CachedConversationStore(ConversationStore):
+    """
+    Read-through LRU cache in front of another store. The TTL bounds how long
+    a worker can serve a thread id that another process has since replaced.
+    """
+
+    def __init__(self, backend, maxsize=10000, ttl=300):
+        self.backend = backend
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get_thread(self, wa_id):
+        thread_id = self._cache.get(wa_id)
+        if thread_id is None:
+            thread_id = self.backend.get_thread(wa_id)
+            if thread_id is not None:
+                self._cache.set(wa_id, thread_id)
+        return thread_id
+
+    def set_thread(self, wa_id, thread_id):
+        self.backend.set_thread(wa_id, thread_id)
+        self._cache.set(wa_id, thread_id)
+
+    # Usage changes on every message, so it is not cached
+
+    def add_usage(self, thread_id, messages, tokens):
+        return self.backend.add_usage(thread_id, messages, tokens)
+
+    def get_usage(self, thread_id):
+        return self.backend.get_usage(thread_id)
+
+    def set_summary(self, thread_id, summary, messages):
+        self.backend.set_summary(thread_id, summary, messages)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store(config=None):
+    """
+    The store shared by the whole process, created on first use from `config`
+    (default: the current Flask app's config).
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = config if config is not None else current_app.config
+                backend = SQLiteConversationStore(config["CONVERSATION_DB"])
+                backend.migrate_shelve(config["LEGACY_THREADS_DB"])
+                _store = CachedConversationStore(
+                    backend,
+                    maxsize=config["CONVERSATION_CACHE_SIZE"],
+                    ttl=config["CONVERSATION_CACHE_TTL"],
+                )
+    return _store
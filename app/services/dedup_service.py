@@ -0,0 +1,90 @@
+import threading
+import time
+
+from flask import current_app
+
+from app.utils.sqlite_utils import connect
+
+_dedup_lock = threading.Lock()
+
+
+class MessageDeduplicator:
+    """
+    Remembers recently seen WhatsApp message ids so webhook redeliveries are
+    acknowledged without scheduling any work.
+
+    Ids live in a time-bounded in-memory map for the fast path and in their
+    own SQLite table, so a restart (or another gunicorn worker) still knows
+    about them. The SQLite primary key makes `claim` atomic across processes.
+    """
+
+    def __init__(self, path=None, ttl=24 * 3600):
+        self.ttl = ttl
+        self._seen = {}
+        self._lock = threading.Lock()
+        self._db = None
+        self._claims = 0
+
+        if path:
+            self._db = connect(path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS processed_messages (message_id TEXT PRIMARY KEY, seen_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS processed_messages_seen ON processed_messages (seen_at)")
+
+    def claim(self, message_id):
+        """
+        Return True the first time a message id is seen within the TTL, False for duplicates.
+        """
+        now = time.time()
+        with self._lock:
+            seen_at = self._seen.get(message_id)
+            if seen_at is not None and seen_at > now - self.ttl:
+                return False
+
+            if self._db is not None:
+                self._db.execute(
+                    "DELETE FROM processed_messages WHERE message_id = ? AND seen_at <= ?",
+                    (message_id, now - self.ttl),
+                )
+                inserted = self._db.execute(
+                    "INSERT OR IGNORE INTO processed_messages (message_id, seen_at) VALUES (?, ?)", (message_id, now)
+                ).rowcount
+                if not inserted:
+                    self._seen[message_id] = now
+                    return False
+
+            self._seen[message_id] = now
+            self._claims += 1
+            if self._claims % 1000 == 0:
+                self._prune(now)
+            return True
+
+    def release(self, message_id):
+        """
+        Forget a claimed id, e.g. when its work could not be scheduled and
+        Meta should be allowed to redeliver it.
+        """
+        with self._lock:
+            self._seen.pop(message_id, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM processed_messages WHERE message_id = ?", (message_id,))
+
+    def _prune(self, now):
+        cutoff = now - self.ttl
+        self._seen = {message_id: seen_at for message_id, seen_at in self._seen.items() if seen_at > cutoff}
+        if self._db is not None:
+            self._db.execute("DELETE FROM processed_messages WHERE seen_at <= ?", (cutoff,))
+
+
+def get_deduplicator():
+    dedup = current_app.extensions.get("deduplicator")
+    if dedup is None:
+        with _dedup_lock:
+            dedup = current_app.extensions.get("deduplicator")
+            if dedup is None:
+                dedup = current_app.extensions["deduplicator"] = MessageDeduplicator(
+                    path=current_app.config["DEDUP_DB_PATH"],
+                    ttl=current_app.config["DEDUP_TTL"],
+                )
+    return dedup
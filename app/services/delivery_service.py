@@ -0,0 +1,220 @@
+import asyncio
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from flask import current_app
+from urllib3.exceptions import NewConnectionError
+
+from app.services.graph_client import get_graph_client
+from app.utils.metrics import registry, track
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+DELIVERIES = registry.counter("zowobo_deliveries_total", "Outbound messages by final outcome.", ("result",))
+SEND_RETRIES = registry.counter("zowobo_send_retries_total", "Graph API send attempts that were retried.")
+
+_service_lock = threading.Lock()
+
+
+def connect_failed(e):
+    """
+    Whether a requests exception means no connection was ever made, so the
+    message cannot have been sent. A connection reset or a read timeout is
+    also a ConnectionError, but the request may have reached the server.
+    """
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    if not isinstance(e, requests.ConnectionError) or not e.args:
+        return False
+    # requests wraps urllib3's MaxRetryError, whose reason is the cause
+    reason = getattr(e.args[0], "reason", e.args[0])
+    # NameResolutionError (DNS) is a NewConnectionError too
+    return isinstance(reason, NewConnectionError)
+
+
+class TokenBucket:
+    """
+    Blocking token bucket: `rate` tokens per second, bursts up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        # Returns 0 when a token was taken, else how long until one is available
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class BaseDeliveryService:
+    """
+    Rate limiting, backoff and dead-lettering shared by the threaded and
+    asyncio delivery services.
+    """
+
+    def __init__(
+        self,
+        graph_client,
+        rate=80,
+        burst=80,
+        max_retries=5,
+        backoff_base=0.5,
+        backoff_cap=30,
+        dead_letter_path=None,
+    ):
+        self.graph_client = graph_client
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.dead_letter_path = dead_letter_path
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+        self._dead_letter_lock = threading.Lock()
+
+    def _bucket(self, phone_number_id):
+        with self._buckets_lock:
+            bucket = self._buckets.get(phone_number_id)
+            if bucket is None:
+                bucket = self._buckets[phone_number_id] = TokenBucket(self.rate, self.burst)
+            return bucket
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after and retry_after.isdigit():
+            # Capped, so a bogus header cannot park a sender thread for hours
+            return min(float(retry_after), self.backoff_cap)
+        # Full jitter keeps a burst of failed sends from retrying in lockstep
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2**attempt))
+
+    def _dead_letter(self, data, error):
+        logger.error(f"Giving up on message delivery: {error}")
+        if not self.dead_letter_path:
+            return
+        record = {"time": time.time(), "error": error, "payload": json.loads(data)}
+        with self._dead_letter_lock:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class DeliveryService(BaseDeliveryService):
+    """
+    Outbound message delivery for the WhatsApp Cloud API.
+
+    Messages are sent from a small thread pool, rate limited per sending phone
+    number, retried with jittered exponential backoff on 429/5xx and network
+    errors, and written to a dead-letter log when they cannot be delivered.
+    """
+
+    def __init__(self, graph_client, workers=8, **kwargs):
+        super().__init__(graph_client, **kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="delivery")
+
+    def submit(self, data):
+        """
+        Queue a message payload for delivery and return a Future for its response.
+        """
+        # Carry the caller's log context (message id, wa_id) into the sender thread
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, self._deliver, data)
+
+    def _deliver(self, data):
+        bucket = self._bucket(self.graph_client.phone_number_id)
+        error = None
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            retry_after = None
+            try:
+                with track("graph_send"):
+                    response = self.graph_client.send_message(data)
+            except requests.RequestException as e:
+                error = str(e)
+                # Only failures to connect are safe to retry: after a read
+                # timeout or a reset the message may well have been sent already
+                if not connect_failed(e):
+                    break
+                logger.warning(f"Sending message failed (attempt {attempt + 1}): {e}")
+            else:
+                if response.ok:
+                    log_http_response(response)
+                    DELIVERIES.inc(result="sent")
+                    return response
+                error = f"{response.status_code} {response.text}"
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    break
+                logger.warning(f"Sending message failed (attempt {attempt + 1}): {error}")
+                retry_after = response.headers.get("Retry-After")
+
+            if attempt < self.max_retries:
+                SEND_RETRIES.inc()
+                time.sleep(self._backoff(attempt, retry_after))
+
+        DELIVERIES.inc(result="dead_letter")
+        self._dead_letter(data, error)
+        return None
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def log_http_response(response):
+    # Lazy %-formatting: the body is only rendered when DEBUG is enabled
+    logger.debug(
+        "Status: %s, Content-type: %s, Body: %s",
+        response.status_code,
+        response.headers.get("content-type"),
+        response.text,
+    )
+
+
+def get_delivery_service():
+    """
+    Return the delivery service of the current app, creating it on first use.
+    """
+    service = current_app.extensions.get("delivery_service")
+    if service is None:
+        with _service_lock:
+            service = current_app.extensions.get("delivery_service")
+            if service is None:
+                config = current_app.config
+                service = current_app.extensions["delivery_service"] = DeliveryService(
+                    get_graph_client(),
+                    rate=config["SEND_RATE_LIMIT"],
+                    burst=config["SEND_RATE_BURST"],
+                    workers=config["SEND_WORKERS"],
+                    max_retries=config["SEND_MAX_RETRIES"],
+                    dead_letter_path=config["SEND_DEAD_LETTER_PATH"],
+                )
+    return service
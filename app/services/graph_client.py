@@ -0,0 +1,69 @@
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+
+
+class GraphClient:
+    """
+    Shared client for the WhatsApp Cloud (Graph) API.
+
+    One keep-alive session per worker process, so consecutive calls reuse the
+    TCP+TLS connection to graph.facebook.com instead of handshaking every time.
+    URLs, headers and timeouts are computed once here.
+    """
+
+    def __init__(
+        self,
+        access_token,
+        version,
+        phone_number_id,
+        base_url="https://graph.facebook.com",
+        pool_size=10,
+        timeout=(3.05, 10),
+    ):
+        self.phone_number_id = phone_number_id
+        self.base_url = f"{base_url.rstrip('/')}/{version}"
+        self.messages_url = f"{self.base_url}/{phone_number_id}/messages"
+        self.auth_headers = {"Authorization": f"Bearer {access_token}"}
+        self.json_headers = {**self.auth_headers, "Content-type": "application/json"}
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def send_message(self, data):
+        return self.session.post(self.messages_url, data=data, headers=self.json_headers, timeout=self.timeout)
+
+    def get_media(self, media_id):
+        return self.session.get(f"{self.base_url}/{media_id}", headers=self.auth_headers, timeout=self.timeout)
+
+    def download(self, url, headers=None):
+        return self.session.get(
+            url, headers={**self.auth_headers, **(headers or {})}, timeout=self.timeout, stream=True
+        )
+
+    def close(self):
+        self.session.close()
+
+
+def create_graph_client(config):
+    return GraphClient(
+        access_token=config["ACCESS_TOKEN"],
+        version=config["VERSION"],
+        phone_number_id=config["PHONE_NUMBER_ID"],
+        base_url=config["GRAPH_API_BASE_URL"],
+        pool_size=config["GRAPH_POOL_SIZE"],
+        timeout=(config["GRAPH_CONNECT_TIMEOUT"], config["GRAPH_READ_TIMEOUT"]),
+    )
+
+
+def get_graph_client():
+    """
+    Return the Graph API client of the current app, creating it on first use.
+    """
+    client = current_app.extensions.get("graph_client")
+    if client is None:
+        client = current_app.extensions.setdefault("graph_client", create_graph_client(current_app.config))
+    return client
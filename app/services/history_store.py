@@ -0,0 +1,76 @@
+import threading
+import time
+
+from flask import current_app
+
+from app.utils.sqlite_utils import connect
+
+
+class SQLiteHistoryStore:
+    """
+    Recent turns of each conversation for the chat completions engine, in
+    SQLite (WAL mode, so safe to share between gunicorn workers). Only the
+    last `max_messages` messages per WhatsApp id are kept.
+    """
+
+    def __init__(self, path, max_messages=20):
+        self.path = path
+        self.max_messages = max_messages
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, wa_id TEXT NOT NULL, role TEXT NOT NULL, "
+            "content TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS turns_wa_id ON turns (wa_id, id)")
+
+    def get(self, wa_id, limit=None):
+        """
+        The most recent messages for `wa_id`, oldest first, as chat messages.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT role, content FROM turns WHERE wa_id = ? ORDER BY id DESC LIMIT ?",
+                (wa_id, limit or self.max_messages),
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    def append(self, wa_id, messages):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            # Commits, or rolls back if a statement fails so the shared
+            # connection is not left inside an open transaction
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO turns (wa_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                    [(wa_id, message["role"], message["content"], now) for message in messages],
+                )
+                self._conn.execute(
+                    "DELETE FROM turns WHERE wa_id = ? AND id < "
+                    "(SELECT id FROM turns WHERE wa_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (wa_id, wa_id, self.max_messages - 1),
+                )
+
+    def clear(self, wa_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM turns WHERE wa_id = ?", (wa_id,))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_history_store(config=None):
+    """
+    The store shared by the whole process, created on first use from `config`
+    (default: the current Flask app's config).
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = config if config is not None else current_app.config
+                _store = SQLiteHistoryStore(config["HISTORY_DB"], max_messages=2 * config["CHAT_HISTORY_TURNS"])
+    return _store
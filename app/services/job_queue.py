@@ -0,0 +1,184 @@
+import contextvars
+import json
+import logging
+import queue
+import threading
+
+from app.utils.metrics import registry
+from app.utils.sqlite_utils import connect
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DEPTH = registry.gauge("zowobo_job_queue_depth", "Accepted webhook events not finished yet.")
+
+# The job the current worker is handling, for defer_job()
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class _Job:
+    __slots__ = ("queue", "id", "deferred", "finished")
+
+    def __init__(self, job_queue, job_id):
+        self.queue = job_queue
+        self.id = job_id
+        self.deferred = False
+        self.finished = False
+
+    def finish(self):
+        if not self.finished:
+            self.finished = True
+            self.queue._finish(self.id)
+
+
+def defer_job():
+    """
+    Keep the job being handled outstanding after its handler returns, e.g.
+    while its reply waits in a conversation mailbox. Returns a callable that
+    finishes the job, or None when not called from a job worker.
+    """
+    job = _current_job.get()
+    if job is None:
+        return None
+    job.deferred = True
+    return job.finish
+
+
+class JobQueue:
+    """
+    Bounded in-process queue of webhook payloads drained by a pool of worker threads.
+
+    The webhook only has to enqueue a payload and return, so Meta gets its 200
+    in milliseconds while transcription and Assistants runs happen here. When a
+    path is given, pending jobs are also written to SQLite and replayed on the
+    next start, so a restart does not lose accepted messages.
+
+    A job counts against `maxsize` and stays persisted until it is finished:
+    when its handler returns, or later if the handler called defer_job().
+    """
+
+    def __init__(self, app, handler, workers=4, maxsize=1000, path=None):
+        self.app = app
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+        self.path = path
+        self._queue = queue.Queue()
+        self._outstanding = 0
+        self._outstanding_lock = threading.Lock()
+        self._threads = []
+        self._db = None
+        self._db_lock = threading.Lock()
+
+        if path:
+            self._db = connect(path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL)"
+            )
+
+    def start(self):
+        if self._threads:
+            return
+        self._replay_pending()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} job workers")
+
+    def stop(self, timeout=None):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, payload):
+        """
+        Enqueue a payload without blocking. Returns False if the queue is full.
+        """
+        with self._outstanding_lock:
+            if self.maxsize and self._outstanding >= self.maxsize:
+                logger.error("Job queue is full, rejecting webhook event")
+                return False
+            self._outstanding += 1
+        try:
+            job_id = self._persist(payload)
+        except Exception:
+            self._release()
+            raise
+        self._queue.put_nowait((job_id, payload))
+        return True
+
+    def qsize(self):
+        return self._outstanding
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            job_id, payload = job
+            current = _Job(self, job_id)
+            token = _current_job.set(current)
+            try:
+                with self.app.app_context():
+                    self.handler(payload)
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}")
+            finally:
+                _current_job.reset(token)
+                if not current.deferred:
+                    current.finish()
+                self._queue.task_done()
+
+    def _finish(self, job_id):
+        try:
+            self._forget(job_id)
+        finally:
+            self._release()
+
+    def _release(self):
+        with self._outstanding_lock:
+            self._outstanding -= 1
+
+    def _persist(self, payload):
+        if self._db is None:
+            return None
+        with self._db_lock:
+            cursor = self._db.execute("INSERT INTO jobs (payload) VALUES (?)", (json.dumps(payload),))
+            return cursor.lastrowid
+
+    def _forget(self, job_id):
+        if self._db is None or job_id is None:
+            return
+        with self._db_lock:
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def _replay_pending(self):
+        if self._db is None:
+            return
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT id, payload FROM jobs ORDER BY id LIMIT ?", (self.maxsize or -1,)
+            ).fetchall()
+        with self._outstanding_lock:
+            self._outstanding += len(rows)
+        for job_id, payload in rows:
+            self._queue.put_nowait((job_id, json.loads(payload)))
+        if rows:
+            logger.info(f"Replayed {len(rows)} pending jobs from {self.path}")
+
+
+def init_job_queue(app, handler):
+    job_queue = JobQueue(
+        app,
+        handler,
+        workers=app.config["WORKER_COUNT"],
+        maxsize=app.config["JOB_QUEUE_MAXSIZE"],
+        path=app.config["JOB_QUEUE_PATH"],
+    )
+    job_queue.start()
+    app.extensions["job_queue"] = job_queue
+    QUEUE_DEPTH.set_function(job_queue.qsize)
+    return job_queue
@@ -0,0 +1,306 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+from app.utils.text_utils import tokenize
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT = 1
+ARRAYS = ("postings_indptr", "postings_docs", "postings_weights", "doc_indptr", "doc_terms", "doc_tfs")
+KNOWLEDGE_EXTENSIONS = (".txt", ".md")
+
+
+def chunk_text(text, max_words=120, overlap=20):
+    """
+    Split a document into passages of at most `max_words` words. Paragraphs
+    are kept whole and packed together; longer ones are cut into
+    overlapping windows.
+    """
+    chunks, current, count = [], [], 0
+    for paragraph in (p.strip() for p in re.split(r"\n\s*\n", text)):
+        if not paragraph:
+            continue
+        words = paragraph.split()
+        if current and count + len(words) > max_words:
+            chunks.append("\n\n".join(current))
+            current, count = [], 0
+        if len(words) > max_words:
+            step = max(1, max_words - overlap)
+            for start in range(0, len(words), step):
+                chunks.append(" ".join(words[start : start + max_words]))
+                if start + max_words >= len(words):
+                    break
+            continue
+        current.append(paragraph)
+        count += len(words)
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def collect_files(knowledge_dir):
+    """
+    Map each knowledge file under `knowledge_dir`, relative path first, to its absolute path.
+    """
+    files = {}
+    for root, _, names in os.walk(knowledge_dir):
+        for name in names:
+            if name.endswith(KNOWLEDGE_EXTENSIONS):
+                path = os.path.join(root, name)
+                files[os.path.relpath(path, knowledge_dir)] = path
+    return files
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class KnowledgeIndex:
+    """
+    BM25 index over knowledge base passages.
+
+    BM25 weights are computed once at build time and stored term-major
+    (CSR: postings_indptr/postings_docs/postings_weights), so a query is a
+    few vectorized slice-adds into a score array plus an argpartition.
+    Per-passage term counts are kept doc-major as well; a rebuild reuses
+    them for files that did not change and only re-reads the ones that did.
+    Arrays are saved as .npy files in a versioned directory and memory-mapped on load.
+    """
+
+    def __init__(self, terms, chunks, manifest, arrays, params):
+        self.terms = terms
+        self.vocabulary = {term: term_id for term_id, term in enumerate(terms)}
+        self.chunks = chunks
+        self.manifest = manifest
+        self.params = params
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def search(self, query, k=3):
+        """
+        Return up to `k` (score, chunk) pairs for the query, best first.
+        Each chunk is a dict with "text" and "source".
+        """
+        term_ids = {self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary}
+        if not term_ids or not self.chunks:
+            return []
+
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.postings_indptr[term_id], self.postings_indptr[term_id + 1]
+            scores[self.postings_docs[start:end]] += self.postings_weights[start:end]
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.chunks[i]) for i in top if scores[i] > 0]
+
+    def doc_counts(self, doc):
+        start, end = self.doc_indptr[doc], self.doc_indptr[doc + 1]
+        return {self.terms[term_id]: int(tf) for term_id, tf in zip(self.doc_terms[start:end], self.doc_tfs[start:end])}
+
+    def unchanged(self, relpath, path):
+        entry = self.manifest.get(relpath)
+        if entry is None:
+            return False
+        stat = os.stat(path)
+        if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return True
+        # Touched but possibly identical (e.g. a fresh checkout)
+        return entry["size"] == stat.st_size and entry["sha256"] == file_sha256(path)
+
+    def is_current(self, files, params):
+        return (
+            params == self.params
+            and set(files) == set(self.manifest)
+            and all(self.unchanged(relpath, path) for relpath, path in files.items())
+        )
+
+    @classmethod
+    def build(cls, files, previous=None, max_words=120, overlap=20, k1=1.5, b=0.75):
+        params = {"max_words": max_words, "overlap": overlap, "k1": k1, "b": b}
+        reusable = previous is not None and previous.params == params
+
+        chunks, doc_counts, manifest = [], [], {}
+        reused = 0
+        for relpath, path in sorted(files.items()):
+            stat = os.stat(path)
+            start = len(chunks)
+            if reusable and previous.unchanged(relpath, path):
+                entry = previous.manifest[relpath]
+                for doc in range(entry["start"], entry["end"]):
+                    chunks.append(previous.chunks[doc])
+                    doc_counts.append(previous.doc_counts(doc))
+                sha256 = entry["sha256"]
+                reused += 1
+            else:
+                with open(path, encoding="utf-8") as f:
+                    text = f.read()
+                for passage in chunk_text(text, max_words, overlap):
+                    chunks.append({"text": passage, "source": relpath})
+                    doc_counts.append(Counter(tokenize(passage)))
+                sha256 = file_sha256(path)
+            manifest[relpath] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "sha256": sha256,
+                "start": start,
+                "end": len(chunks),
+            }
+
+        index = cls._from_counts(chunks, doc_counts, manifest, params)
+        logger.info(f"Indexed {len(chunks)} passages from {len(files)} knowledge files ({reused} unchanged)")
+        return index
+
+    @classmethod
+    def _from_counts(cls, chunks, doc_counts, manifest, params):
+        vocabulary = {}
+        docs, term_ids, tfs = [], [], []
+        for doc, counts in enumerate(doc_counts):
+            for term, tf in counts.items():
+                docs.append(doc)
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                tfs.append(tf)
+
+        n_docs, n_terms = len(doc_counts), len(vocabulary)
+        docs = np.asarray(docs, dtype=np.int32)
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.float32)
+
+        k1, b = params["k1"], params["b"]
+        doc_len = np.bincount(docs, weights=tfs, minlength=n_docs)
+        avgdl = doc_len.mean() if n_docs else 1.0
+        df = np.bincount(term_ids, minlength=n_terms)
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+        weights = idf[term_ids] * tfs * (k1 + 1) / (tfs + k1 * (1 - b + b * doc_len[docs] / avgdl))
+
+        order = np.lexsort((docs, term_ids))
+        postings_indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(df, out=postings_indptr[1:])
+        doc_indptr = np.zeros(n_docs + 1, dtype=np.int64)
+        np.cumsum(np.bincount(docs, minlength=n_docs), out=doc_indptr[1:])
+
+        arrays = {
+            "postings_indptr": postings_indptr,
+            "postings_docs": docs[order],
+            "postings_weights": weights[order].astype(np.float32),
+            "doc_indptr": doc_indptr,
+            "doc_terms": term_ids,
+            "doc_tfs": tfs.astype(np.int32),
+        }
+        terms = [None] * n_terms
+        for term, term_id in vocabulary.items():
+            terms[term_id] = term
+        return cls(terms, chunks, manifest, arrays, params)
+
+    def save(self, index_dir):
+        """
+        Write the index to a fresh version directory under `index_dir`, then
+        switch the CURRENT pointer to it with one atomic rename. A crash, or
+        another worker saving at the same time, never leaves a mix of old and
+        new files behind the pointer.
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        version_dir = tempfile.mkdtemp(prefix="index-", dir=index_dir)
+        for name in ARRAYS:
+            np.save(os.path.join(version_dir, f"{name}.npy"), np.asarray(getattr(self, name)))
+        meta = {
+            "format": INDEX_FORMAT,
+            "params": self.params,
+            "terms": self.terms,
+            "chunks": self.chunks,
+            "manifest": self.manifest,
+            "postings": int(len(self.postings_docs)),
+        }
+        with open(os.path.join(version_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        previous = _current_version(index_dir)
+        fd, tmp = tempfile.mkstemp(prefix="CURRENT.", dir=index_dir)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(os.path.basename(version_dir))
+        os.replace(tmp, os.path.join(index_dir, "CURRENT"))
+        # Workers that memory-mapped the old version keep their open files
+        if previous and previous != os.path.basename(version_dir):
+            shutil.rmtree(os.path.join(index_dir, previous), ignore_errors=True)
+
+    @classmethod
+    def load(cls, index_dir):
+        """
+        Memory-map the current saved index, or return None if there is no usable one.
+        """
+        try:
+            version = _current_version(index_dir)
+            if version is None:
+                return None
+            version_dir = os.path.join(index_dir, version)
+            with open(os.path.join(version_dir, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("format") != INDEX_FORMAT:
+                return None
+            arrays = {name: np.load(os.path.join(version_dir, f"{name}.npy"), mmap_mode="r") for name in ARRAYS}
+        except (OSError, ValueError) as e:
+            logger.info(f"No usable knowledge index in {index_dir}: {e}")
+            return None
+        if len(arrays["postings_docs"]) != meta["postings"] or len(arrays["doc_indptr"]) != len(meta["chunks"]) + 1:
+            return None
+        return cls(meta["terms"], meta["chunks"], meta["manifest"], arrays, meta["params"])
+
+
+def _current_version(index_dir):
+    try:
+        with open(os.path.join(index_dir, "CURRENT"), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_or_build(knowledge_dir, index_dir, max_words=120, overlap=20, k1=1.5, b=0.75):
+    """
+    Return an index for the files in `knowledge_dir`, memory-mapping the saved
+    one when it is current and rebuilding (incrementally) when it is not.
+    """
+    started = time.perf_counter()
+    files = collect_files(knowledge_dir)
+    params = {"max_words": max_words, "overlap": overlap, "k1": k1, "b": b}
+
+    index = KnowledgeIndex.load(index_dir)
+    if index is not None and index.is_current(files, params):
+        logger.info(f"Loaded knowledge index ({len(index)} passages) in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return index
+
+    index = KnowledgeIndex.build(files, previous=index, **params)
+    index.save(index_dir)
+    return index
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description="Build or refresh the knowledge retrieval index.")
+    parser.add_argument("--knowledge-dir", default=os.getenv("KNOWLEDGE_DIR", "data"))
+    parser.add_argument("--index-dir", default=os.getenv("KNOWLEDGE_INDEX_DIR", "knowledge_index"))
+    parser.add_argument("--query", help="print the top passages for a query")
+    args = parser.parse_args()
+
+    knowledge_index = load_or_build(args.knowledge_dir, args.index_dir)
+    if args.query:
+        for score, chunk in knowledge_index.search(args.query, k=3):
+            print(f"{score:6.2f}  [{chunk['source']}] {chunk['text'][:200]!r}")
@@ -0,0 +1,187 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+_mailbox_lock = threading.Lock()
+
+
+class _Mailbox:
+    __slots__ = ("name", "pending", "callbacks", "last_posted", "timer", "busy")
+
+    def __init__(self, name):
+        self.name = name
+        self.pending = []
+        self.callbacks = []
+        self.last_posted = 0.0
+        self.timer = None
+        self.busy = False
+
+
+class ConversationMailbox:
+    """
+    Per-wa_id ordered mailboxes with at most one reply in flight per user.
+
+    A message posted to an idle mailbox starts a `debounce` timer, which each
+    further message pushes back. Once the user has been quiet that long (or
+    `max_batch` messages are waiting), everything queued so far goes to
+    `handler` as one batch on the mailbox's reply threads, which keep
+    draining until the mailbox is empty. Rapid-fire messages thus become a
+    single Assistants run instead of several runs colliding on the same
+    thread, and posting never parks the calling worker. Without a debounce
+    the posting worker replies straight away.
+
+    `done`, if given to post(), is called once the reply covering that
+    message has been handled (or has failed), e.g. to finish its job.
+    """
+
+    def __init__(self, handler, debounce=0.2, max_batch=10, workers=4):
+        self.handler = handler
+        self.debounce = debounce
+        self.max_batch = max_batch
+        self._boxes = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mailbox")
+
+    def post(self, wa_id, name, text, done=None):
+        with self._lock:
+            box = self._boxes.get(wa_id)
+            if box is None:
+                box = self._boxes[wa_id] = _Mailbox(name)
+            box.name = name
+            box.pending.append(text)
+            if done is not None:
+                box.callbacks.append(done)
+            box.last_posted = time.monotonic()
+            if box.busy:
+                # The reply in flight picks it up when it is done
+                return
+            if self.debounce > 0 and len(box.pending) < self.max_batch:
+                if box.timer is None:
+                    self._arm(wa_id, box, self.debounce)
+                return
+            if box.timer is not None:
+                box.timer.cancel()
+                box.timer = None
+            box.busy = True
+
+        self._drain(wa_id, box)
+
+    def _arm(self, wa_id, box, delay):
+        # Called with the lock held. The handler runs in the context of the
+        # message that armed the timer, for the app context and log fields.
+        context = contextvars.copy_context()
+        timer = threading.Timer(
+            delay, lambda: self._executor.submit(context.run, self._on_timer, wa_id, box, timer)
+        )
+        timer.daemon = True
+        box.timer = timer
+        timer.start()
+
+    def _on_timer(self, wa_id, box, timer):
+        with self._lock:
+            if box.timer is not timer:
+                # Cancelled: max_batch was reached and a poster took over
+                return
+            box.timer = None
+            remaining = box.last_posted + self.debounce - time.monotonic()
+            if remaining > 0 and len(box.pending) < self.max_batch:
+                self._arm(wa_id, box, remaining)
+                return
+            box.busy = True
+
+        self._drain(wa_id, box)
+
+    def _drain(self, wa_id, box):
+        while True:
+            with self._lock:
+                if not box.pending:
+                    del self._boxes[wa_id]
+                    return
+                remaining = box.last_posted + self.debounce - time.monotonic()
+                if remaining > 0 and len(box.pending) < self.max_batch:
+                    # More messages arrived during the last reply: wait for
+                    # the user to be quiet again on a timer
+                    box.busy = False
+                    self._arm(wa_id, box, remaining)
+                    return
+                batch, box.pending = box.pending, []
+                callbacks, box.callbacks = box.callbacks, []
+                name = box.name
+
+            if len(batch) > 1:
+                logger.info(f"Coalesced {len(batch)} messages from wa_id {wa_id}")
+            try:
+                self.handler(wa_id, name, batch)
+            except Exception as e:
+                logger.error(f"Failed to reply to wa_id {wa_id}: {e}")
+            finally:
+                for done in callbacks:
+                    done()
+
+
+class AsyncConversationMailbox:
+    """
+    ConversationMailbox for one asyncio event loop, with the same debounce
+    and one-reply-in-flight-per-user rules. `handler` is a coroutine function.
+    No locks are needed since everything runs on the loop's thread.
+    """
+
+    def __init__(self, handler, debounce=0.2, max_batch=10):
+        self.handler = handler
+        self.debounce = debounce
+        self.max_batch = max_batch
+        self._boxes = {}
+
+    async def post(self, wa_id, name, text):
+        box = self._boxes.get(wa_id)
+        owner = box is None
+        if owner:
+            box = self._boxes[wa_id] = _Mailbox(name)
+        box.name = name
+        box.pending.append(text)
+        box.last_posted = time.monotonic()
+
+        if owner:
+            await self._drain(wa_id, box)
+
+    async def _drain(self, wa_id, box):
+        while True:
+            while len(box.pending) < self.max_batch:
+                remaining = box.last_posted + self.debounce - time.monotonic()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(remaining)
+
+            if not box.pending:
+                del self._boxes[wa_id]
+                return
+            batch, box.pending = box.pending, []
+
+            if len(batch) > 1:
+                logger.info(f"Coalesced {len(batch)} messages from wa_id {wa_id}")
+            try:
+                await self.handler(wa_id, box.name, batch)
+            except Exception as e:
+                logger.error(f"Failed to reply to wa_id {wa_id}: {e}")
+
+
+def get_mailbox(handler):
+    mailbox = current_app.extensions.get("mailbox")
+    if mailbox is None:
+        with _mailbox_lock:
+            mailbox = current_app.extensions.get("mailbox")
+            if mailbox is None:
+                mailbox = current_app.extensions["mailbox"] = ConversationMailbox(
+                    handler,
+                    debounce=current_app.config["MESSAGE_DEBOUNCE_MS"] / 1000,
+                    max_batch=current_app.config["MESSAGE_MAX_BATCH"],
+                    workers=current_app.config["WORKER_COUNT"],
+                )
+    return mailbox
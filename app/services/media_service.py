@@ -0,0 +1,130 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+import requests
+
+from app.services.graph_client import get_graph_client
+
+logger = logging.getLogger(__name__)
+
+
+class MediaError(Exception):
+    pass
+
+
+class MediaTooLarge(MediaError):
+    pass
+
+
+def extension_for(mime_type):
+    return "ogg" if mime_type and "ogg" in mime_type else "mp3"
+
+
+class MediaFile:
+    """
+    A downloaded media object owned by one message.
+
+    Bytes are spooled in memory up to `spool_max_bytes` and roll over to an
+    anonymous temp file beyond that. Consumers that need a real path (Whisper,
+    file uploads) get a uniquely named copy via `path()`. Everything is removed
+    on `close()`, so always use it as a context manager.
+    """
+
+    def __init__(self, mime_type, spool_max_bytes=1024 * 1024, max_bytes=None):
+        self.mime_type = mime_type
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool_max_bytes, prefix="wa-media-")
+        self._path = None
+
+    @property
+    def extension(self):
+        return extension_for(self.mime_type)
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise MediaTooLarge(f"Media exceeds {self.max_bytes} bytes")
+        self._sha256.update(chunk)
+        self._file.write(chunk)
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+    def read_bytes(self):
+        self._file.seek(0)
+        return self._file.read()
+
+    def path(self):
+        if self._path is None:
+            fd, path = tempfile.mkstemp(prefix="wa-media-", suffix=f".{self.extension}")
+            with os.fdopen(fd, "wb") as f:
+                self._file.seek(0)
+                shutil.copyfileobj(self._file, f)
+            self._path = path
+        return self._path
+
+    def close(self):
+        self._file.close()
+        if self._path is not None:
+            try:
+                os.remove(self._path)
+            except FileNotFoundError:
+                pass
+            self._path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def download_media(url, mime_type, max_bytes, spool_max_bytes, headers=None):
+    """
+    Stream a media URL into a MediaFile, enforcing `max_bytes` both from the
+    Content-Length header and while reading. Raises MediaError on failure.
+    """
+    try:
+        response = get_graph_client().download(url, headers=headers)
+    except requests.RequestException as e:
+        raise MediaError(f"Request to download media failed: {e}") from e
+
+    with response:
+        if response.status_code != 200:
+            raise MediaError(f"Failed to download media: {response.status_code} {response.text[:500]}")
+
+        content_length = response.headers.get("Content-Length")
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            raise MediaTooLarge(f"Media is {content_length} bytes, limit is {max_bytes}")
+
+        media = MediaFile(mime_type or response.headers.get("Content-Type"), spool_max_bytes, max_bytes)
+        try:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                media.write(chunk)
+        except requests.RequestException as e:
+            media.close()
+            raise MediaError(f"Media download interrupted: {e}") from e
+        except Exception:
+            media.close()
+            raise
+
+    logger.info(f"Downloaded {media.size} bytes of {media.mime_type}")
+    return media
+
+
+def open_local_media(file_path, mime_type, max_bytes, spool_max_bytes):
+    media = MediaFile(mime_type, spool_max_bytes, max_bytes)
+    try:
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b""):
+                media.write(chunk)
+    except Exception:
+        media.close()
+        raise
+    return media
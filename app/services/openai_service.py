@@ -1,14 +1,67 @@
-from openai import OpenAI
-import shelve
+from openai import AsyncOpenAI, OpenAI, NotFoundError
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from flask import current_app
+import asyncio
+import contextvars
 import os
-import time
 import logging
+import threading
+
+from app.services.answer_cache import ANSWER_CACHE_ENTRIES, AnswerCache, load_faq
+from app.services.assistant_runs import wait_for_run, wait_for_run_async
+from app.services.conversation_store import get_conversation_store
+from app.utils.cache import LRUCache
+from app.utils.metrics import registry, track
+from app.utils.text_utils import approximate_tokens
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_ASSISTANT_ID = os.getenv("OPENAI_ASSISTANT_ID")
-client = OpenAI(api_key=OPENAI_API_KEY)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+# Used by the ASGI entry point; it opens no connections until first awaited
+async_client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+
+# Assistant objects rarely change, so keep them instead of re-fetching
+# them for every message
+metadata_cache = LRUCache(maxsize=100)
+
+# Frequent questions are answered from here without touching the thread.
+# Off by default: a cached answer ignores the rest of the conversation.
+_answer_cache = None
+_answer_cache_loaded = False
+_answer_cache_lock = threading.Lock()
+
+# Appends cached exchanges and summarizes long threads off the reply path
+_background_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="openai-background")
+_background_tasks = set()
+
+THREAD_ROTATIONS = registry.counter("zowobo_thread_rotations_total", "Threads replaced by a summary-seeded thread.")
+SUMMARY_INSTRUCTIONS = (
+    "Summarize this WhatsApp conversation between a user and Zowobo, an AI assistant, so that Zowobo can "
+    "continue it without the full history. Keep the user's name, the language they write in, facts they "
+    "shared, what was already answered and anything still open. Write the summary in the language of the "
+    "conversation, in under 200 words."
+)
+SUMMARY_PREFIX = "Summary of our conversation so far:\n"
+# Threads with a summary being written, so each is summarized once at a time
+_summarizing = set()
+_summarizing_lock = threading.Lock()
+
+# Local BM25 index over the knowledge files, loaded on first use
+_knowledge_index = None
+_knowledge_index_lock = threading.Lock()
+
+# Thread lookup-or-create is serialized per wa_id (striped by hash), since a
+# voice note prepares the thread while the mailbox may be replying
+_thread_locks = [threading.Lock() for _ in range(64)]
+_async_thread_locks = [asyncio.Lock() for _ in range(64)]
+
+# The Assistant's instructions, also used as the system prompt of the chat engine
+ZOWOBO_INSTRUCTIONS = "Zowobo is a WhatsApp assistant designed to give Haitians access to AI technology. It can listen to voice messages and respond in Haitian Creole. Zowobo is here to answer questions, provide information, and help with various issues. If there's something it doesn't know, it will clearly say so and suggest seeking help elsewhere. Zowobo always tries to give simple, useful, and easy-to-understand responses. It has a bit of a sense of humor too, but its main goal is to help Haitians access knowledge and information through AI technology. Zowobo responds to haitian creole with haitian creole and responds to english with english. Most requests will be in Haitian creole. Zowobo se yon asistan WhatsApp ki la pou ede Ayisyen yo jwenn aksè ak teknoloji AI. Li kapab tande mesaj vwa epi reponn yo nan lang kreyòl ayisyen. Zowobo la pou reponn kesyon, bay enfòmasyon, epi ede ak divès kalite pwoblèm. Si gen yon bagay li pa konnen, l ap di sa klè epi sijere moun nan chèche èd lòt kote. Zowobo toujou ap eseye bay repons ki senp, itil, epi ki fasil pou konprann. Li gen yon ti sans imou tou, men prensipal objektif li se ede Ayisyen yo jwenn aksè ak konesans ak enfòmasyon atravè teknoloji AI."
 
 
 # def upload_file(path):
@@ -24,7 +77,7 @@ def create_assistant(file):
     """
     assistant = client.beta.assistants.create(
         name="Zowobo",
-        instructions="Zowobo is a WhatsApp assistant designed to give Haitians access to AI technology. It can listen to voice messages and respond in Haitian Creole. Zowobo is here to answer questions, provide information, and help with various issues. If there's something it doesn't know, it will clearly say so and suggest seeking help elsewhere. Zowobo always tries to give simple, useful, and easy-to-understand responses. It has a bit of a sense of humor too, but its main goal is to help Haitians access knowledge and information through AI technology. Zowobo responds to haitian creole with haitian creole and responds to english with english. Most requests will be in Haitian creole. Zowobo se yon asistan WhatsApp ki la pou ede Ayisyen yo jwenn aksè ak teknoloji AI. Li kapab tande mesaj vwa epi reponn yo nan lang kreyòl ayisyen. Zowobo la pou reponn kesyon, bay enfòmasyon, epi ede ak divès kalite pwoblèm. Si gen yon bagay li pa konnen, l ap di sa klè epi sijere moun nan chèche èd lòt kote. Zowobo toujou ap eseye bay repons ki senp, itil, epi ki fasil pou konprann. Li gen yon ti sans imou tou, men prensipal objektif li se ede Ayisyen yo jwenn aksè ak konesans ak enfòmasyon atravè teknoloji AI.",
+        instructions=ZOWOBO_INSTRUCTIONS,
         # tools=[{"type": "retrieval"}],
         model="gpt-4o-mini",
         # file_ids=[file.id],
@@ -32,67 +85,522 @@ def create_assistant(file):
     return assistant
 
 
-# Use context manager to ensure the shelf file is closed properly
+def get_assistant(assistant_id=None):
+    assistant_id = assistant_id or OPENAI_ASSISTANT_ID
+    key = ("assistant", assistant_id)
+    assistant = metadata_cache.get(key)
+    if assistant is None:
+        assistant = client.beta.assistants.retrieve(assistant_id)
+        metadata_cache.set(key, assistant, ttl=current_app.config["METADATA_CACHE_TTL"])
+    return assistant
+
+
+def invalidate_metadata(kind=None, object_id=None):
+    """
+    Drop cached metadata for one object, or everything when called without arguments.
+    """
+    if kind is None:
+        metadata_cache.clear()
+    else:
+        metadata_cache.pop((kind, object_id))
+
+
+def get_answer_cache(config=None):
+    """
+    The answer cache, built on first use from `config` (default: the current
+    Flask app's config), or None when ANSWER_CACHE_ENABLED is off.
+    """
+    global _answer_cache, _answer_cache_loaded
+    if not _answer_cache_loaded:
+        with _answer_cache_lock:
+            if not _answer_cache_loaded:
+                config = config if config is not None else current_app.config
+                if config["ANSWER_CACHE_ENABLED"]:
+                    faq_file = config["ANSWER_CACHE_FAQ_FILE"]
+                    _answer_cache = AnswerCache(
+                        maxsize=config["ANSWER_CACHE_SIZE"],
+                        ttl=config["ANSWER_CACHE_TTL"],
+                        similarity=config["ANSWER_CACHE_SIMILARITY"],
+                        min_users=config["ANSWER_CACHE_MIN_USERS"],
+                        faq=load_faq(faq_file) if faq_file else None,
+                    )
+                    ANSWER_CACHE_ENTRIES.set_function(lambda: len(_answer_cache))
+                _answer_cache_loaded = True
+    return _answer_cache
+
+
+def cache_shared_answer(answer_cache, message_body):
+    """
+    Answer a question many users asked without anyone's conversation, and
+    cache that answer for the next ones to ask.
+    """
+    from app.services import chat_engine
+
+    try:
+        answer_cache.set(message_body, chat_engine.generate_shared_answer(message_body))
+    except Exception as e:
+        logger.warning(f"Failed to generate a shared answer: {e}")
+
+
+async def cache_shared_answer_async(answer_cache, message_body):
+    from app.services import chat_engine
+
+    try:
+        answer_cache.set(message_body, await chat_engine.generate_shared_answer_async(message_body))
+    except Exception as e:
+        logger.warning(f"Failed to generate a shared answer: {e}")
+
+
 def check_if_thread_exists(wa_id):
-    with shelve.open("threads_db") as threads_shelf:
-        return threads_shelf.get(wa_id, None)
+    return get_conversation_store().get_thread(wa_id)
 
 
 def store_thread(wa_id, thread_id):
-    with shelve.open("threads_db", writeback=True) as threads_shelf:
-        threads_shelf[wa_id] = thread_id
+    get_conversation_store().set_thread(wa_id, thread_id)
+
 
+def get_knowledge_index():
+    global _knowledge_index
+    if _knowledge_index is None:
+        with _knowledge_index_lock:
+            if _knowledge_index is None:
+                # Imported here so numpy is only needed with retrieval enabled
+                from app.services.knowledge_index import load_or_build
 
-def run_assistant(thread, name):
-    # Retrieve the Assistant
-    assistant = client.beta.assistants.retrieve(OPENAI_ASSISTANT_ID)
+                config = current_app.config
+                _knowledge_index = load_or_build(config["KNOWLEDGE_DIR"], config["KNOWLEDGE_INDEX_DIR"])
+    return _knowledge_index
 
-    # Run the assistant
-    run = client.beta.threads.runs.create(
-        thread_id=thread.id,
-        assistant_id=assistant.id,
-        # instructions=f"You are having a conversation with {name}",
+
+def retrieval_instructions(message_body):
+    """
+    Knowledge passages relevant to the message, formatted as run-level
+    additional instructions, or None when retrieval is off or nothing matches.
+    """
+    if not current_app.config["RETRIEVAL_ENABLED"] or not message_body:
+        return None
+    try:
+        with track("retrieval"):
+            results = get_knowledge_index().search(message_body, k=current_app.config["RETRIEVAL_TOP_K"])
+    except Exception as e:
+        logger.warning(f"Knowledge retrieval failed: {e}")
+        return None
+    if not results:
+        return None
+
+    passages, used = [], 0
+    for _, chunk in results:
+        text = chunk["text"][: current_app.config["RETRIEVAL_MAX_CHARS"] - used]
+        if not text:
+            break
+        passages.append(f"[{chunk['source']}]\n{text}")
+        used += len(text)
+    logger.debug(f"Attached {len(passages)} knowledge passages to the run")
+    return (
+        "Reference material that may help answer the latest message. "
+        "Use it only if it is relevant, and answer in the user's language.\n\n" + "\n\n".join(passages)
     )
 
-    # Wait for completion
-    # https://platform.openai.com/docs/assistants/how-it-works/runs-and-run-steps#:~:text=under%20failed_at.-,Polling%20for%20updates,-In%20order%20to
-    while run.status != "completed":
-        # Be nice to the API
-        time.sleep(1)
-        run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-        print(str(run))
-
-    # Retrieve the Messages
-    messages = client.beta.threads.messages.list(thread_id=thread.id)
-    new_message = messages.data[0].content[0].text.value
-    logging.info(f"Generated message: {new_message}")
+
+def run_assistant(thread_id, name, message_body=None, on_text=None):
+    # Retrieve the Assistant (cached)
+    assistant = get_assistant()
+
+    run_kwargs = {}
+    instructions = retrieval_instructions(message_body)
+    if instructions:
+        run_kwargs["additional_instructions"] = instructions
+
+    # Run the assistant and wait for the reply, streaming where possible
+    # https://platform.openai.com/docs/assistants/how-it-works/runs-and-run-steps
+    try:
+        with track("run_wait"):
+            new_message = wait_for_run(
+                client,
+                thread_id=thread_id,
+                assistant_id=assistant.id,
+                timeout=current_app.config["ASSISTANT_RUN_TIMEOUT"],
+                stream=current_app.config["ASSISTANT_RUN_STREAMING"],
+                # instructions=f"You are having a conversation with {name}",
+                on_text=on_text,
+                **run_kwargs,
+            )
+    except NotFoundError:
+        invalidate_metadata("assistant", assistant.id)
+        raise
+    logger.debug("Generated message: %s", new_message)
     return new_message
 
 
-def generate_response(message_body, wa_id, name):
-    # Check if there is already a thread_id for the wa_id
-    thread_id = check_if_thread_exists(wa_id)
+def create_thread(wa_id, name, messages=None):
+    logger.info(f"Creating new thread for {name} with wa_id {wa_id}")
+    thread = client.beta.threads.create(**({"messages": messages} if messages else {}))
+    store_thread(wa_id, thread.id)
+    return thread.id
+
+
+def get_or_create_thread(wa_id, name):
+    with _thread_locks[hash(wa_id) % len(_thread_locks)]:
+        thread_id = check_if_thread_exists(wa_id)
+        if thread_id is None:
+            thread_id = create_thread(wa_id, name)
+    return thread_id
+
+
+def prepare_conversation(wa_id, name):
+    """
+    Resolve or create the user's thread and load the assistant ahead of a
+    reply, so that work overlaps with something slower (a voice note being
+    downloaded and transcribed). Returns the thread id, or None with the
+    chat engine, which only reads local history.
+    """
+    if current_app.config["RESPONSE_ENGINE"] == "chat":
+        return None
+    with track("thread_prepare"):
+        get_assistant()
+        return get_or_create_thread(wa_id, name)
+
+
+def append_exchange(wa_id, name, message_body, answer):
+    """
+    Record a question answered from the cache in the user's thread, so later
+    runs still see it.
+    """
+    try:
+        thread_id = get_or_create_thread(wa_id, name)
+        client.beta.threads.messages.create(thread_id=thread_id, role="user", content=message_body)
+        client.beta.threads.messages.create(thread_id=thread_id, role="assistant", content=answer)
+        record_messages(thread_id, message_body, answer)
+    except Exception as e:
+        logger.warning(f"Failed to append cached answer to the thread of wa_id {wa_id}: {e}")
+
+
+def record_messages(thread_id, *texts):
+    """
+    Count messages added to a thread; returns its (messages, tokens) totals.
+    """
+    return get_conversation_store().add_usage(thread_id, len(texts), sum(approximate_tokens(text) for text in texts))
+
+
+def ready_summary(thread_id):
+    """
+    The summary to start a new thread from, if one was written and still
+    covers every message in the thread.
+    """
+    usage = get_conversation_store().get_usage(thread_id)
+    if usage is None:
+        return None
+    messages, _, summary, summary_messages = usage
+    return summary if summary and summary_messages == messages else None
+
+
+def _claim_summary(thread_id, usage):
+    messages, tokens = usage
+    max_messages, max_tokens = current_app.config["THREAD_MAX_MESSAGES"], current_app.config["THREAD_MAX_TOKENS"]
+    if not (max_messages and messages >= max_messages) and not (max_tokens and tokens >= max_tokens):
+        return False
+    with _summarizing_lock:
+        if thread_id in _summarizing:
+            return False
+        _summarizing.add(thread_id)
+    return True
+
+
+def _release_summary(thread_id):
+    with _summarizing_lock:
+        _summarizing.discard(thread_id)
+
 
-    # If a thread doesn't exist, create one and store it
-    if thread_id is None:
-        logging.info(f"Creating new thread for {name} with wa_id {wa_id}")
-        thread = client.beta.threads.create()
-        store_thread(wa_id, thread.id)
-        thread_id = thread.id
+def _summary_request(messages):
+    lines = []
+    for message in reversed(messages):
+        text = "\n".join(block.text.value for block in message.content if block.type == "text")
+        lines.append(f"{'User' if message.role == 'user' else 'Zowobo'}: {text}")
+    return {
+        "model": current_app.config["THREAD_SUMMARY_MODEL"],
+        "messages": [
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+            {"role": "user", "content": "\n\n".join(lines)},
+        ],
+    }
 
-    # Otherwise, retrieve the existing thread
+
+def summarize_thread(thread_id, message_count):
+    """
+    Write the summary a thread that outgrew THREAD_MAX_MESSAGES or
+    THREAD_MAX_TOKENS is rotated from. Runs in the background after a reply;
+    the next message then starts a new thread seeded with it.
+    """
+    try:
+        with track("summarize"):
+            # Newest first, so a thread longer than the page keeps its recent turns
+            messages = client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=100)
+            completion = client.chat.completions.create(**_summary_request(messages.data))
+        summary = completion.choices[0].message.content
+        if summary:
+            get_conversation_store().set_summary(thread_id, summary, message_count)
+    except Exception as e:
+        logger.warning(f"Failed to summarize thread {thread_id}: {e}")
+    finally:
+        _release_summary(thread_id)
+
+
+def maybe_summarize(thread_id, usage):
+    if _claim_summary(thread_id, usage):
+        logger.info(f"Thread {thread_id} reached {usage[0]} messages / ~{usage[1]} tokens, summarizing")
+        context = contextvars.copy_context()
+        _background_executor.submit(context.run, summarize_thread, thread_id, usage[0])
+
+
+def rotation_messages(summary, message_body):
+    return [
+        {"role": "assistant", "content": SUMMARY_PREFIX + summary},
+        {"role": "user", "content": message_body},
+    ]
+
+
+def finish_rotation(wa_id, old_thread_id, thread_id, summary, message_body):
+    record_messages(thread_id, summary, message_body)
+    THREAD_ROTATIONS.inc()
+    logger.info(f"Rotated wa_id {wa_id} from thread {old_thread_id} to {thread_id}")
+
+
+def add_user_message(thread_id, message_body, wa_id, name):
+    """
+    Add the user's message to their thread and return the thread id. The
+    stored id is trusted without a retrieve call; if the thread was deleted on
+    OpenAI's side, a new one is started.
+    """
+    try:
+        client.beta.threads.messages.create(
+            thread_id=thread_id,
+            role="user",
+            content=message_body,
+        )
+    except NotFoundError:
+        logger.warning(f"Thread {thread_id} for wa_id {wa_id} no longer exists")
+        thread_id = create_thread(wa_id, name)
+        client.beta.threads.messages.create(
+            thread_id=thread_id,
+            role="user",
+            content=message_body,
+        )
+    record_messages(thread_id, message_body)
+    return thread_id
+
+
+def generate_response(message_body, wa_id, name, on_text=None):
+    """
+    Reply to a user's message(s) with the configured RESPONSE_ENGINE. With
+    `on_text`, the reply is also passed to it piece by piece as it is
+    generated, for streaming replies.
+    """
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        answer = answer_cache.get(message_body)
+        if answer is not None:
+            logger.info(f"Answered wa_id {wa_id} from the answer cache")
+            if on_text is not None:
+                on_text(answer)
+            append = current_app.config["ANSWER_CACHE_APPEND_TO_THREAD"]
+            if append and current_app.config["RESPONSE_ENGINE"] == "chat":
+                from app.services.chat_engine import record_exchange
+
+                record_exchange(wa_id, message_body, answer)
+            elif append:
+                context = contextvars.copy_context()
+                _background_executor.submit(context.run, append_exchange, wa_id, name, message_body, answer)
+            return answer
+
+    if current_app.config["RESPONSE_ENGINE"] == "chat":
+        # Imported here since chat_engine builds on this module
+        from app.services import chat_engine
+
+        new_message = chat_engine.generate_response(message_body, wa_id, name, on_text)
     else:
-        logging.info(f"Retrieving existing thread for {name} with wa_id {wa_id}")
-        thread = client.beta.threads.retrieve(thread_id)
+        new_message = generate_assistant_response(message_body, wa_id, name, on_text)
+
+    # The reply above used this user's conversation, so it is not shareable
+    if answer_cache is not None and answer_cache.popular(message_body, wa_id):
+        context = contextvars.copy_context()
+        _background_executor.submit(context.run, cache_shared_answer, answer_cache, message_body)
+    return new_message
+
+
+def generate_assistant_response(message_body, wa_id, name, on_text=None):
+    # Check if there is already a thread_id for the wa_id,
+    # otherwise create one and store it
+    with track("thread_lookup"):
+        thread_id = get_or_create_thread(wa_id, name)
+        summary = ready_summary(thread_id)
 
     # Add message to thread
-    message = client.beta.threads.messages.create(
-        thread_id=thread_id,
-        role="user",
-        content=message_body,
-    )
+    with track("message_create"):
+        if summary is not None:
+            # The thread outgrew its limits: continue in a new one that starts
+            # from the summary, created together with this message
+            old_thread_id = thread_id
+            thread_id = create_thread(wa_id, name, messages=rotation_messages(summary, message_body))
+            finish_rotation(wa_id, old_thread_id, thread_id, summary, message_body)
+        else:
+            thread_id = add_user_message(thread_id, message_body, wa_id, name)
 
     # Run the assistant and get the new message
-    new_message = run_assistant(thread, name)
+    new_message = run_assistant(thread_id, name, message_body, on_text)
+    maybe_summarize(thread_id, record_messages(thread_id, new_message))
+    return new_message
+
+
+async def get_assistant_async(assistant_id=None):
+    assistant_id = assistant_id or OPENAI_ASSISTANT_ID
+    key = ("assistant", assistant_id)
+    assistant = metadata_cache.get(key)
+    if assistant is None:
+        assistant = await async_client.beta.assistants.retrieve(assistant_id)
+        metadata_cache.set(key, assistant, ttl=current_app.config["METADATA_CACHE_TTL"])
+    return assistant
+
+
+async def run_assistant_async(thread_id, name, message_body=None, on_text=None):
+    assistant = await get_assistant_async()
+    run_kwargs = {}
+    instructions = retrieval_instructions(message_body)
+    if instructions:
+        run_kwargs["additional_instructions"] = instructions
+    try:
+        with track("run_wait"):
+            new_message = await wait_for_run_async(
+                async_client,
+                thread_id=thread_id,
+                assistant_id=assistant.id,
+                timeout=current_app.config["ASSISTANT_RUN_TIMEOUT"],
+                stream=current_app.config["ASSISTANT_RUN_STREAMING"],
+                on_text=on_text,
+                **run_kwargs,
+            )
+    except NotFoundError:
+        invalidate_metadata("assistant", assistant.id)
+        raise
+    logger.debug("Generated message: %s", new_message)
+    return new_message
+
+
+async def create_thread_async(wa_id, name, messages=None):
+    logger.info(f"Creating new thread for {name} with wa_id {wa_id}")
+    thread = await async_client.beta.threads.create(**({"messages": messages} if messages else {}))
+    await asyncio.to_thread(store_thread, wa_id, thread.id)
+    return thread.id
+
+
+async def get_or_create_thread_async(wa_id, name):
+    async with _async_thread_locks[hash(wa_id) % len(_async_thread_locks)]:
+        thread_id = await asyncio.to_thread(check_if_thread_exists, wa_id)
+        if thread_id is None:
+            thread_id = await create_thread_async(wa_id, name)
+    return thread_id
+
+
+async def prepare_conversation_async(wa_id, name):
+    if current_app.config["RESPONSE_ENGINE"] == "chat":
+        return None
+    with track("thread_prepare"):
+        await get_assistant_async()
+        return await get_or_create_thread_async(wa_id, name)
+
+
+async def append_exchange_async(wa_id, name, message_body, answer):
+    try:
+        thread_id = await get_or_create_thread_async(wa_id, name)
+        await async_client.beta.threads.messages.create(thread_id=thread_id, role="user", content=message_body)
+        await async_client.beta.threads.messages.create(thread_id=thread_id, role="assistant", content=answer)
+        await asyncio.to_thread(record_messages, thread_id, message_body, answer)
+    except Exception as e:
+        logger.warning(f"Failed to append cached answer to the thread of wa_id {wa_id}: {e}")
+
+
+async def summarize_thread_async(thread_id, message_count):
+    try:
+        with track("summarize"):
+            messages = await async_client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=100)
+            completion = await async_client.chat.completions.create(**_summary_request(messages.data))
+        summary = completion.choices[0].message.content
+        if summary:
+            await asyncio.to_thread(get_conversation_store().set_summary, thread_id, summary, message_count)
+    except Exception as e:
+        logger.warning(f"Failed to summarize thread {thread_id}: {e}")
+    finally:
+        _release_summary(thread_id)
+
+
+def maybe_summarize_async(thread_id, usage):
+    if _claim_summary(thread_id, usage):
+        logger.info(f"Thread {thread_id} reached {usage[0]} messages / ~{usage[1]} tokens, summarizing")
+        task = asyncio.create_task(summarize_thread_async(thread_id, usage[0]))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+
+async def add_user_message_async(thread_id, message_body, wa_id, name):
+    try:
+        await async_client.beta.threads.messages.create(thread_id=thread_id, role="user", content=message_body)
+    except NotFoundError:
+        logger.warning(f"Thread {thread_id} for wa_id {wa_id} no longer exists")
+        thread_id = await create_thread_async(wa_id, name)
+        await async_client.beta.threads.messages.create(thread_id=thread_id, role="user", content=message_body)
+    await asyncio.to_thread(record_messages, thread_id, message_body)
+    return thread_id
+
+
+async def generate_response_async(message_body, wa_id, name, on_text=None):
+    """
+    generate_response for the ASGI entry point. The conversation and history
+    stores are SQLite, so their calls run in a thread off the event loop.
+    """
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        answer = answer_cache.get(message_body)
+        if answer is not None:
+            logger.info(f"Answered wa_id {wa_id} from the answer cache")
+            if on_text is not None:
+                on_text(answer)
+            append = current_app.config["ANSWER_CACHE_APPEND_TO_THREAD"]
+            if append and current_app.config["RESPONSE_ENGINE"] == "chat":
+                from app.services.chat_engine import record_exchange
+
+                await asyncio.to_thread(record_exchange, wa_id, message_body, answer)
+            elif append:
+                task = asyncio.create_task(append_exchange_async(wa_id, name, message_body, answer))
+                _background_tasks.add(task)
+                task.add_done_callback(_background_tasks.discard)
+            return answer
+
+    if current_app.config["RESPONSE_ENGINE"] == "chat":
+        from app.services import chat_engine
+
+        new_message = await chat_engine.generate_response_async(message_body, wa_id, name, on_text)
+    else:
+        new_message = await generate_assistant_response_async(message_body, wa_id, name, on_text)
+
+    if answer_cache is not None and answer_cache.popular(message_body, wa_id):
+        task = asyncio.create_task(cache_shared_answer_async(answer_cache, message_body))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    return new_message
+
+
+async def generate_assistant_response_async(message_body, wa_id, name, on_text=None):
+    with track("thread_lookup"):
+        thread_id = await get_or_create_thread_async(wa_id, name)
+        summary = await asyncio.to_thread(ready_summary, thread_id)
+
+    with track("message_create"):
+        if summary is not None:
+            old_thread_id = thread_id
+            thread_id = await create_thread_async(wa_id, name, messages=rotation_messages(summary, message_body))
+            await asyncio.to_thread(finish_rotation, wa_id, old_thread_id, thread_id, summary, message_body)
+        else:
+            thread_id = await add_user_message_async(thread_id, message_body, wa_id, name)
 
+    new_message = await run_assistant_async(thread_id, name, message_body, on_text)
+    maybe_summarize_async(thread_id, await asyncio.to_thread(record_messages, thread_id, new_message))
     return new_message
@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+
+from flask import current_app
+
+from app.utils.cache import LRUCache
+from app.utils.sqlite_utils import connect
+
+logger = logging.getLogger(__name__)
+
+_cache_lock = threading.Lock()
+
+
+def media_key(media_id):
+    return f"media:{media_id}"
+
+
+def content_key(digest):
+    return f"sha256:{digest}"
+
+
+class TranscriptionCache:
+    """
+    Two-tier cache of voice note transcriptions.
+
+    Entries are stored under the WhatsApp media id and under the SHA-256 of
+    the audio bytes, so a redelivered webhook hits before downloading and a
+    forwarded voice note (new media id, same bytes) hits before transcribing.
+    A bounded in-memory LRU sits in front of a SQLite tier that expires
+    entries after `ttl` seconds and drops the oldest ones past `max_disk_bytes`.
+    """
+
+    def __init__(self, path=None, memory_size=2048, ttl=30 * 24 * 3600, max_disk_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = LRUCache(maxsize=memory_size, ttl=ttl)
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._disk_bytes = 0
+
+        if path:
+            self._db = connect(path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS transcriptions ("
+                "key TEXT PRIMARY KEY, text TEXT NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS transcriptions_created ON transcriptions (created_at)")
+            self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM transcriptions").fetchone()[0]
+
+    def get(self, *keys):
+        for key in keys:
+            text = self._memory.get(key)
+            if text is not None:
+                return text
+
+        if self._db is None:
+            return None
+        for key in keys:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT text FROM transcriptions WHERE key = ? AND created_at > ?",
+                    (key, time.time() - self.ttl),
+                ).fetchone()
+            if row:
+                self._memory.set(key, row[0])
+                return row[0]
+        return None
+
+    def set(self, keys, text):
+        for key in keys:
+            self._memory.set(key, text)
+
+        if self._db is None:
+            return
+        size = len(text.encode("utf-8"))
+        now = time.time()
+        with self._db_lock:
+            self._db.execute("BEGIN")
+            # A failed insert must not leave the transaction open, or every
+            # later BEGIN on this connection fails
+            with self._db:
+                for key in keys:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO transcriptions (key, text, size, created_at) VALUES (?, ?, ?, ?)",
+                        (key, text, size, now),
+                    )
+            self._disk_bytes += size * len(keys)
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict(now)
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM transcriptions WHERE created_at <= ?", (now - self.ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM transcriptions").fetchone()[0]
+        if total > self.max_disk_bytes:
+            # Drop the oldest entries until we are back under 90% of the budget
+            excess = total - int(self.max_disk_bytes * 0.9)
+            rows = self._db.execute("SELECT key, size FROM transcriptions ORDER BY created_at").fetchall()
+            victims = []
+            for key, size in rows:
+                if excess <= 0:
+                    break
+                victims.append((key,))
+                excess -= size
+            self._db.executemany("DELETE FROM transcriptions WHERE key = ?", victims)
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM transcriptions").fetchone()[0]
+            logger.info(f"Evicted {len(victims)} cached transcriptions")
+        self._disk_bytes = total
+
+
+def get_transcription_cache():
+    cache = current_app.extensions.get("transcription_cache")
+    if cache is None:
+        with _cache_lock:
+            cache = current_app.extensions.get("transcription_cache")
+            if cache is None:
+                config = current_app.config
+                cache = current_app.extensions["transcription_cache"] = TranscriptionCache(
+                    path=config["TRANSCRIPTION_CACHE_PATH"],
+                    memory_size=config["TRANSCRIPTION_CACHE_SIZE"],
+                    ttl=config["TRANSCRIPTION_CACHE_TTL"],
+                    max_disk_bytes=config["TRANSCRIPTION_CACHE_MAX_BYTES"],
+                )
+    return cache
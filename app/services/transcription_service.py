@@ -0,0 +1,183 @@
+import asyncio
+import importlib
+import logging
+import threading
+import time
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+
+TRANSCRIPTION_PROMPT = (
+    "Transcribe this audio file of a Haitian Creole speaker into Haitian Creole text. "
+    "No additional comments before or after. Just the transcription."
+)
+
+
+class GeminiTranscriber:
+    """
+    Transcribes voice notes with Google Gemini.
+
+    The client and model are configured once per worker. Clips under
+    GEMINI_INLINE_MAX_BYTES are sent inline with the prompt in a single
+    generate_content call; only larger files go through the upload API.
+    """
+
+    def __init__(self, config):
+        genai = importlib.import_module("google.generativeai")
+        types = importlib.import_module("google.generativeai.types")
+        HarmCategory, HarmBlockThreshold = types.HarmCategory, types.HarmBlockThreshold
+
+        options = {}
+        if config["GEMINI_API_ENDPOINT"]:
+            options = {"transport": "rest", "client_options": {"api_endpoint": config["GEMINI_API_ENDPOINT"]}}
+        genai.configure(api_key=config["GEMINI_API_KEY"], **options)
+        self.genai = genai
+        self.inline_max_bytes = config["GEMINI_INLINE_MAX_BYTES"]
+        self.request_options = {"timeout": config["GEMINI_TIMEOUT"]}
+        self.model = genai.GenerativeModel(
+            model_name=config["GEMINI_MODEL"],
+            generation_config={
+                "temperature": 1,
+                "top_p": 0.95,
+                "top_k": 64,
+                "max_output_tokens": 8192,
+                "response_mime_type": "text/plain",
+            },
+            safety_settings={
+                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+            },
+        )
+
+    def transcribe(self, media):
+        if media.size <= self.inline_max_bytes:
+            audio_part = self._inline_part(media)
+        else:
+            audio_part = self._upload(media)
+
+        response = self.model.generate_content(
+            [audio_part, TRANSCRIPTION_PROMPT], request_options=self.request_options
+        )
+        return response.text
+
+    async def transcribe_async(self, media):
+        if media.size <= self.inline_max_bytes:
+            audio_part = self._inline_part(media)
+        else:
+            # The upload API has no async variant
+            audio_part = await asyncio.to_thread(self._upload, media)
+
+        response = await self.model.generate_content_async(
+            [audio_part, TRANSCRIPTION_PROMPT], request_options=self.request_options
+        )
+        return response.text
+
+    @staticmethod
+    def _mime_type(media):
+        return "audio/ogg" if media.extension == "ogg" else "audio/mpeg"
+
+    def _inline_part(self, media):
+        return {"mime_type": self._mime_type(media), "data": media.read_bytes()}
+
+    def _upload(self, media):
+        audio_file = self.genai.upload_file(media.path(), mime_type=self._mime_type(media))
+        logger.info(f"Uploaded file '{audio_file.display_name}' as: {audio_file.uri}")
+        return audio_file
+
+
+class WhisperTranscriber:
+    """
+    Transcribes voice notes locally with OpenAI Whisper. Importing whisper pulls
+    in torch, so this only happens when the provider is selected.
+
+    With WHISPER_PROCESSES > 0 the work runs on a WhisperEngine process pool;
+    with 0 the model is loaded and run in the calling process, one
+    transcription at a time since a Whisper model is not thread-safe.
+    """
+
+    def __init__(self, config):
+        self.engine = None
+        self.model = None
+        self._model_lock = threading.Lock()
+        if config["WHISPER_PROCESSES"] > 0:
+            from app.services.whisper_engine import WhisperEngine
+
+            self.engine = WhisperEngine(
+                model_name=config["WHISPER_MODEL"],
+                processes=config["WHISPER_PROCESSES"],
+                threads_per_process=config["WHISPER_THREADS_PER_PROCESS"],
+            )
+        else:
+            whisper = importlib.import_module("whisper")
+            self.model = whisper.load_model(config["WHISPER_MODEL"])
+
+    def transcribe(self, media):
+        audio_path = media.path()
+        logger.debug("Starting transcription for file: %s", audio_path)
+        if self.engine is not None:
+            return self.engine.transcribe(audio_path)
+        with self._model_lock:
+            result = self.model.transcribe(audio_path)
+        return result["text"]
+
+    async def transcribe_async(self, media):
+        if self.engine is not None:
+            return await asyncio.wrap_future(self.engine.submit(media.path()))
+        return await asyncio.to_thread(self.transcribe, media)
+
+
+# Provider name -> factory taking the app config. Factories run on first use.
+PROVIDERS = {
+    "gemini": GeminiTranscriber,
+    "whisper": WhisperTranscriber,
+}
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def register_provider(name, factory):
+    PROVIDERS[name] = factory
+
+
+def get_transcriber(name=None, config=None):
+    """
+    Return the transcriber for `name` (default: TRANSCRIPTION_PROVIDER),
+    loading it and its dependencies the first time it is asked for.
+    `config` defaults to the current Flask app's config.
+    """
+    config = config if config is not None else current_app.config
+    name = name or config["TRANSCRIPTION_PROVIDER"]
+    transcriber = _instances.get(name)
+    if transcriber is None:
+        with _instances_lock:
+            transcriber = _instances.get(name)
+            if transcriber is None:
+                if name not in PROVIDERS:
+                    raise ValueError(f"Unknown transcription provider: {name}")
+                started = time.perf_counter()
+                transcriber = _instances[name] = PROVIDERS[name](config)
+                logger.info(f"Loaded transcription provider '{name}' in {time.perf_counter() - started:.2f}s")
+    return transcriber
+
+
+def transcribe_audio(media, provider=None):
+    """
+    Transcribe a MediaFile with the given or configured provider.
+    """
+    return get_transcriber(provider).transcribe(media)
+
+
+async def transcribe_audio_async(media, provider=None, config=None):
+    """
+    Async variant of transcribe_audio for the ASGI entry point. Providers
+    without a native async API run in a worker thread.
+    """
+    transcriber = get_transcriber(provider, config)
+    if hasattr(transcriber, "transcribe_async"):
+        return await transcriber.transcribe_async(media)
+    return await asyncio.to_thread(transcriber.transcribe, media)
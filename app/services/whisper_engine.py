@@ -0,0 +1,94 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# The Whisper model of the current process. In the parent it is loaded before
+# the pool forks, so workers share its memory pages instead of each loading a copy.
+_model = None
+
+
+def _load_model(model_name):
+    global _model
+    if _model is None:
+        import whisper
+
+        _model = whisper.load_model(model_name)
+    return _model
+
+
+def _init_worker(model_name, threads, counter):
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+
+    # A forked worker inherits the parent's QueueHandler but not the thread
+    # that drains its queue, so log straight to stderr instead
+    from app.utils.logging_utils import JsonFormatter, TextFormatter
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if os.getenv("LOG_FORMAT", "json").lower() == "json" else TextFormatter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+
+    # Pin each worker to its own slice of cores so processes do not fight
+    # over the same CPUs, and keep torch from spawning a thread per core.
+    if hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        start = (index * threads) % len(cpus)
+        os.sched_setaffinity(0, cpus[start : start + threads] or cpus)
+
+    import torch
+
+    torch.set_num_threads(threads)
+    _load_model(model_name)
+
+
+def _transcribe(path):
+    return _model.transcribe(path)["text"]
+
+
+class WhisperEngine:
+    """
+    Local Whisper transcription on a fixed pool of worker processes, one
+    loaded model each. Each voice note is its own task, so a short note is
+    never held up behind a long one.
+    """
+
+    def __init__(self, model_name="base", processes=2, threads_per_process=1):
+        self.model_name = model_name
+
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+        if context.get_start_method() == "fork":
+            _load_model(model_name)
+
+        started = time.perf_counter()
+        self._pool = context.Pool(
+            processes,
+            initializer=_init_worker,
+            initargs=(model_name, threads_per_process, context.Value("i", 0)),
+        )
+        logger.info(
+            f"Started {processes} Whisper '{model_name}' workers "
+            f"({context.get_start_method()}) in {time.perf_counter() - started:.2f}s"
+        )
+
+    def submit(self, audio_path):
+        future = Future()
+        self._pool.apply_async(
+            _transcribe, (audio_path,), callback=future.set_result, error_callback=future.set_exception
+        )
+        return future
+
+    def transcribe(self, audio_path, timeout=None):
+        return self.submit(audio_path).result(timeout)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
@@ -0,0 +1,16 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+
+def loads(data):
+    """
+    Parse JSON from bytes or str, using orjson when it is installed.
+    Both raise a json.JSONDecodeError subclass on invalid input.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
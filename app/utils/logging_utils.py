@@ -0,0 +1,118 @@
+import contextvars
+import json
+import logging
+import random
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Fields such as request_id, message_id and wa_id attached to every record
+# logged while they are bound, including from helper modules.
+_log_context = contextvars.ContextVar("log_context", default={})
+
+CONTEXT_FIELDS = ("request_id", "message_id", "wa_id")
+
+
+@contextmanager
+def log_context(**fields):
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+def bind_log_context(**fields):
+    """
+    Bind fields for the rest of the current context; returns a token for `unbind_log_context`.
+    """
+    return _log_context.set({**_log_context.get(), **fields})
+
+
+def unbind_log_context(token):
+    _log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Copy the bound context onto the record. Runs in the logging thread's
+    caller, before the record is handed to the queue.
+    """
+
+    def filter(self, record):
+        context = _log_context.get()
+        for field in CONTEXT_FIELDS:
+            setattr(record, field, context.get(field))
+        return True
+
+
+class TruncateFilter(logging.Filter):
+    """
+    Render the message once and cut it to `max_length` characters, so large
+    payloads cost a bounded amount to format, queue and write.
+    """
+
+    def __init__(self, max_length=1000):
+        super().__init__()
+        self.max_length = max_length
+
+    def filter(self, record):
+        message = record.getMessage()
+        if self.max_length and len(message) > self.max_length:
+            message = f"{message[: self.max_length]}... [{len(message) - self.max_length} chars truncated]"
+        record.msg = message
+        record.args = None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of DEBUG records; higher levels always pass.
+    """
+
+    def __init__(self, debug_sample_rate=1.0):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.debug_sample_rate >= 1:
+            return True
+        return random.random() < self.debug_sample_rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s%(context)s")
+
+    def format(self, record):
+        fields = [f"{field}={getattr(record, field)}" for field in CONTEXT_FIELDS if getattr(record, field, None)]
+        record.context = f" [{' '.join(fields)}]" if fields else ""
+        return super().format(record)
+
+
+def parse_levels(spec):
+    """
+    Parse "app.views=WARNING,app.services.openai_service=DEBUG" into a dict.
+    """
+    levels = {}
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
@@ -0,0 +1,106 @@
+import re
+
+# WhatsApp Cloud API limit on a text message body
+MAX_TEXT_LENGTH = 4096
+
+_PARAGRAPH_END = re.compile(r"\n\s*\n")
+# Sentence punctuation followed by whitespace; not after a digit, so list
+# numbers ("1. ") and decimals do not count
+_SENTENCE_END = re.compile(r"(?<=[^\d\s][.!?…])[\"'»”)\]]*\s+")
+_SPLIT_POINTS = (_PARAGRAPH_END, re.compile(r"\n"), _SENTENCE_END, re.compile(r"\s+"))
+
+
+def balanced(text):
+    """
+    False if cutting after `text` would split WhatsApp formatting that
+    process_text_for_whatsapp rewrites: **bold**, 【citations】 or code fences.
+    """
+    return text.count("**") % 2 == 0 and text.count("【") == text.count("】") and text.count("```") % 2 == 0
+
+
+def split_text(text, limit=MAX_TEXT_LENGTH):
+    """
+    Split text into pieces of at most `limit` characters, cutting at the last
+    paragraph break, line break, sentence end or space that keeps each piece
+    at least half full, and mid-word only as a last resort.
+    """
+    pieces = []
+    text = text.strip()
+    while len(text) > limit:
+        window = text[: limit + 1]
+        cut = limit
+        for pattern in _SPLIT_POINTS:
+            ends = [match.end() for match in pattern.finditer(window) if match.start() >= limit // 2]
+            if ends:
+                cut = min(ends[-1], limit)
+                break
+        pieces.append(text[:cut].strip())
+        text = text[cut:].strip()
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+class ReplySegmenter:
+    """
+    Turns a reply streamed in small pieces into WhatsApp-sized messages.
+
+    The first segment is released at the first sentence end past
+    `first_min_chars`, so the user sees the start of the answer as early as
+    possible without a lone "Bonjou!" message. Later segments are
+    released at paragraph breaks, or at sentence ends once at least
+    `min_chars` have accumulated, so a long answer arrives as a few messages
+    rather than one per sentence. No segment exceeds `limit` characters or
+    cuts through formatting.
+    """
+
+    def __init__(self, min_chars=200, first_min_chars=20, limit=MAX_TEXT_LENGTH):
+        self.min_chars = min_chars
+        self.first_min_chars = first_min_chars
+        self.limit = limit
+        self._buffer = ""
+        self._emitted = 0
+
+    def feed(self, text):
+        """
+        Add generated text; returns the segments that are now complete.
+        """
+        self._buffer += text
+        segments = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                break
+            segment, self._buffer = self._buffer[:cut].strip(), self._buffer[cut:]
+            if segment:
+                segments.append(segment)
+                self._emitted += 1
+        return segments
+
+    def flush(self):
+        """
+        Return whatever is left once generation has finished.
+        """
+        segments = split_text(self._buffer, self.limit)
+        self._buffer = ""
+        self._emitted += len(segments)
+        return segments
+
+    def _find_cut(self):
+        buffer = self._buffer
+        min_chars = self.first_min_chars if self._emitted == 0 else self.min_chars
+        candidates = sorted(
+            [(match.end(), True) for match in _PARAGRAPH_END.finditer(buffer)]
+            + [(match.end(), False) for match in _SENTENCE_END.finditer(buffer)]
+        )
+        for end, paragraph in candidates:
+            if end > self.limit:
+                break
+            segment = buffer[:end].strip()
+            if segment and (paragraph or len(segment) >= min_chars) and balanced(segment):
+                return end
+
+        if len(buffer) > self.limit:
+            # No acceptable boundary within the limit: cut at the best one available
+            return len(split_text(buffer, self.limit)[0]) + (len(buffer) - len(buffer.lstrip()))
+        return None
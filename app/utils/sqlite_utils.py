@@ -0,0 +1,17 @@
+import os
+import sqlite3
+
+
+def connect(path):
+    """
+    Open a SQLite connection tuned for many readers and one writer at a time.
+    WAL mode lets gunicorn workers and background threads share the same file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
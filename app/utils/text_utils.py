@@ -0,0 +1,33 @@
+import re
+import unicodedata
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """
+    Fold case, diacritics, punctuation and whitespace, so "Kisa ou ye ?" and
+    "kisa  ou yé" map to the same key.
+    """
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char)).casefold()
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def ngrams(text, n=3):
+    padded = f" {text} "
+    return frozenset(padded[i : i + n] for i in range(max(1, len(padded) - n + 1)))
+
+
+def tokenize(text):
+    return normalize_text(text).split()
+
+
+def approximate_tokens(text):
+    """
+    Rough token count (about four characters per token) for budgeting
+    context without a tokenizer.
+    """
+    return len(text) // 4 + 1 if text else 0
@@ -0,0 +1,92 @@
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+
+@dataclass(frozen=True)
+class InboundMessage:
+    """
+    One user message from a webhook delivery, with the fields the pipeline needs.
+    """
+
+    id: str
+    wa_id: str
+    name: str
+    type: str
+    timestamp: Optional[str] = None
+    phone_number_id: Optional[str] = None
+    text: Optional[str] = None
+    media_id: Optional[str] = None
+    mime_type: Optional[str] = None
+    voice_file: Optional[str] = None
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+@dataclass(frozen=True)
+class StatusUpdate:
+    """
+    A delivery/read status for a message we sent.
+    """
+
+    id: str
+    recipient_id: Optional[str]
+    status: str
+    timestamp: Optional[str] = None
+
+
+@dataclass
+class WebhookBatch:
+    messages: List[InboundMessage] = field(default_factory=list)
+    statuses: List[StatusUpdate] = field(default_factory=list)
+
+
+def _parse_message(message, value, names):
+    wa_id = message.get("from")
+    media = message.get(message.get("type")) if message.get("type") in ("audio", "voice") else None
+    voice = message.get("voice") or {}
+    return InboundMessage(
+        id=message.get("id"),
+        wa_id=wa_id,
+        name=names.get(wa_id, ""),
+        type=message.get("type"),
+        timestamp=message.get("timestamp"),
+        phone_number_id=value.get("metadata", {}).get("phone_number_id"),
+        text=(message.get("text") or {}).get("body"),
+        media_id=(media or {}).get("id"),
+        mime_type=(media or {}).get("mime_type"),
+        voice_file=voice.get("file"),
+    )
+
+
+def parse_webhook(body):
+    """
+    Walk every entry, change, message and status of a webhook delivery once.
+    Meta may batch several of each into one request.
+    """
+    batch = WebhookBatch()
+    for entry in body.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value") or {}
+            contacts = value.get("contacts") or []
+            names = {contact.get("wa_id"): (contact.get("profile") or {}).get("name", "") for contact in contacts}
+
+            for message in value.get("messages") or []:
+                if not message.get("from") and contacts:
+                    message = {**message, "from": contacts[0].get("wa_id")}
+                batch.messages.append(_parse_message(message, value, names))
+
+            for status in value.get("statuses") or []:
+                batch.statuses.append(
+                    StatusUpdate(
+                        id=status.get("id"),
+                        recipient_id=status.get("recipient_id"),
+                        status=status.get("status"),
+                        timestamp=status.get("timestamp"),
+                    )
+                )
+    return batch
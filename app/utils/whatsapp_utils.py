@@ -1,83 +1,43 @@
-import os
+import contextvars
 import logging
-import subprocess
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from flask import current_app, jsonify
 import json
 import requests
-import whisper
 import re
-import google.generativeai as genai
-from google.generativeai.types import HarmCategory, HarmBlockThreshold
-
-from app.services.openai_service import generate_response
-
-model = whisper.load_model("base")  # Load the Whisper model
-
-
-def transcribe_audio_with_gemini(audio_path):
-    # Configure the Gemini API
-    api_key = current_app.config['GEMINI_API_KEY']
-    genai.configure(api_key=api_key)
-
-    # Upload the audio file to Gemini
-    def upload_to_gemini(path, mime_type=None):
-        file = genai.upload_file(path, mime_type=mime_type)
-        print(f"Uploaded file '{file.display_name}' as: {file.uri}")
-        return file
-
-    # Create the model
-    generation_config = {
-        "temperature": 1,
-        "top_p": 0.95,
-        "top_k": 64,
-        "max_output_tokens": 8192,
-        "response_mime_type": "text/plain",
-    }
-    safety_settings = {
-        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-    }
-    model = genai.GenerativeModel(
-        model_name="gemini-1.5-flash",
-        generation_config=generation_config,
-        safety_settings=safety_settings
-    )
-    model = genai.GenerativeModel(
-        model_name="gemini-1.5-flash",
-        generation_config=generation_config,
-    )
 
-    # Upload the audio file
-    mime_type = "audio/ogg" if audio_path.endswith('.ogg') else "audio/mpeg"
-    uploaded_file = upload_to_gemini(audio_path, mime_type=mime_type)
-
-    # Start a chat session and send the transcription request
-    chat_session = model.start_chat(
-        history=[
-            {
-                "role": "user",
-                "parts": [
-                    uploaded_file,
-                    "Transcribe this audio file of a Haitian Creole speaker into Haitian Creole text. No additional comments before or after. Just the transcription.",
-                ],
-            },
-        ]
-    )
+from app.services.openai_service import generate_response, prepare_conversation
+from app.services.delivery_service import get_delivery_service
+from app.services.graph_client import get_graph_client
+from app.services.job_queue import defer_job
+from app.services.mailbox_service import get_mailbox
+from app.services.media_service import MediaError, download_media, open_local_media
+from app.services.transcription_cache import content_key, get_transcription_cache, media_key
+from app.services.transcription_service import transcribe_audio
+from app.utils.logging_utils import log_context
+from app.utils.metrics import registry, track
+from app.utils.segmenter import MAX_TEXT_LENGTH, ReplySegmenter, split_text
+from app.utils.webhook_parser import InboundMessage
+
+logger = logging.getLogger(__name__)
 
-    # Get the response
-    response = chat_session.send_message("Transcribe the audio")
-    
-    return response.text
+MEDIA_DOWNLOAD_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/68.0.3440.106 Safari/537.36",
+}
 
+TRANSCRIPTION_CACHE_LOOKUPS = registry.counter(
+    "zowobo_transcription_cache_total", "Transcription cache lookups by result.", ("result",)
+)
 
-def log_http_response(response):
-    logging.info(f"Status: {response.status_code}")
-    logging.info(f"Content-type: {response.headers.get('content-type')}")
-    logging.info(f"Body: {response.text}")
+_pipeline_lock = threading.Lock()
 
 def get_text_message_input(recipient, text):
+    if len(text) > MAX_TEXT_LENGTH:
+        # Callers split long replies with split_text; this only guards against a rejected message
+        logger.warning(f"Truncating a {len(text)} character message to the {MAX_TEXT_LENGTH} character limit")
+        text = text[: MAX_TEXT_LENGTH - 1] + "…"
     return json.dumps(
         {
             "messaging_product": "whatsapp",
@@ -88,32 +48,34 @@ def get_text_message_input(recipient, text):
         }
     )
 
-def send_message(data):
-    headers = {
-        "Content-type": "application/json",
-        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
-    }
-
-    url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/messages"
+def get_pipeline_executor():
+    """
+    Runs the steps of a voice note that do not depend on its transcription.
+    Each job worker waits on at most one of them, so one thread per worker
+    means they never queue.
+    """
+    executor = current_app.extensions.get("audio_pipeline")
+    if executor is None:
+        with _pipeline_lock:
+            executor = current_app.extensions.get("audio_pipeline")
+            if executor is None:
+                executor = current_app.extensions["audio_pipeline"] = ThreadPoolExecutor(
+                    max_workers=current_app.config["WORKER_COUNT"], thread_name_prefix="audio-pipeline"
+                )
+    return executor
+
+def get_read_receipt_input(message_id, typing_indicator=True):
+    data = {"messaging_product": "whatsapp", "status": "read", "message_id": message_id}
+    if typing_indicator:
+        data["typing_indicator"] = {"type": "text"}
+    return json.dumps(data)
 
-    try:
-        response = requests.post(
-            url, data=data, headers=headers, timeout=10
-        )  # 10 seconds timeout as an example
-        response.raise_for_status()  # Raises an HTTPError if the HTTP request returned an unsuccessful status code
-    except requests.Timeout:
-        logging.error("Timeout occurred while sending message")
-        return jsonify({"status": "error", "message": "Request timed out"}), 408
-    except (
-        requests.RequestException
-    ) as e:  # This will catch any general request exception
-        logging.error(f"Request failed due to: {e}")
-        logging.error(f"Request failed due to: {str(response.json)}")
-        return jsonify({"status": "error", "message": "Failed to send message"}), 500
-    else:
-        # Process the response as normal
-        log_http_response(response)
-        return response
+def send_message(data):
+    """
+    Hand the message to the delivery service, which rate limits and retries it.
+    Returns a Future resolving to the Graph API response, or None on failure.
+    """
+    return get_delivery_service().submit(data)
 
 def process_text_for_whatsapp(text):
     # Remove brackets
@@ -132,185 +94,241 @@ def process_text_for_whatsapp(text):
 
     return whatsapp_style_text
 
-def process_whatsapp_message(body):
-    wa_id = body["entry"][0]["changes"][0]["value"]["contacts"][0]["wa_id"]
-    name = body["entry"][0]["changes"][0]["value"]["contacts"][0]["profile"]["name"]
+class SegmentedReply:
+    """
+    Sends one reply to `wa_id` as a series of messages, in order: a sender
+    thread submits each segment only once the previous one has been
+    delivered, since the delivery pool would otherwise be free to reorder
+    them. feed() and send() only queue, so generation never waits on delivery.
+    """
 
-    message = body["entry"][0]["changes"][0]["value"]["messages"][0]
-    message_body = message["text"]["body"]
+    def __init__(self, wa_id, min_chars=200):
+        self.wa_id = wa_id
+        self._segmenter = ReplySegmenter(min_chars=min_chars)
+        self._segments = queue.SimpleQueue()
+        self._sender = None
+
+    def feed(self, text):
+        for segment in self._segmenter.feed(text):
+            self.send(segment)
+
+    def close(self, flush=True):
+        """
+        Send whatever is left and wait until every segment has been submitted.
+        With flush=False (the reply failed), a half-written last segment is
+        dropped rather than sent.
+        """
+        if flush:
+            for segment in self._segmenter.flush():
+                self.send(segment)
+        if self._sender is not None:
+            self._segments.put(None)
+            self._sender.join()
+
+    def send(self, segment):
+        segment = process_text_for_whatsapp(segment)
+        if not segment:
+            return
+        if self._sender is None:
+            # The sender needs the app context and log fields of this reply
+            context = contextvars.copy_context()
+            self._sender = threading.Thread(target=context.run, args=(self._send_segments,), name="reply-sender")
+            self._sender.start()
+        self._segments.put(segment)
+
+    def _send_segments(self):
+        pending = None
+        for segment in iter(self._segments.get, None):
+            # One failed segment must not stop the rest of the reply
+            try:
+                if pending is not None:
+                    pending.result()
+            except Exception as e:
+                logger.error(f"Failed to send a reply segment to {self.wa_id}: {e}")
+            try:
+                # Use the sender's wa_id as the recipient
+                pending = send_message(get_text_message_input(self.wa_id, segment))
+            except Exception as e:
+                logger.error(f"Failed to send a reply segment to {self.wa_id}: {e}")
+                pending = None
+
+@track("reply")
+def reply_to_messages(wa_id, name, messages):
+    """
+    Generate and send one reply for a batch of messages from the same user.
+    Called by the conversation mailbox, which guarantees one call per wa_id at a time.
+    With REPLY_STREAMING, segments are sent while the rest is still being generated.
+    """
+    reply = SegmentedReply(wa_id, min_chars=current_app.config["REPLY_SEGMENT_MIN_CHARS"])
 
     # OpenAI Integration
-    response = generate_response(message_body, wa_id, name)
-    response = process_text_for_whatsapp(response)
-
-    # Use the sender's wa_id as the recipient
-    data = get_text_message_input(wa_id, response)
-    send_message(data)
-
-def process_whatsapp_audio_message(body):
-    logging.info(f"Incoming payload: {body}")
-
     try:
-        wa_id = body["entry"][0]["changes"][0]["value"]["contacts"][0]["wa_id"]
-        name = body["entry"][0]["changes"][0]["value"]["contacts"][0]["profile"]["name"]
-
-        message = body["entry"][0]["changes"][0]["value"]["messages"][0]
-
-        logging.info(f"Message object: {message}")
-
-        if "voice" in message:
-            audio_info = message["voice"]
-            audio_file_path = audio_info.get("file")
+        if current_app.config["REPLY_STREAMING"]:
+            generate_response("\n".join(messages), wa_id, name, on_text=reply.feed)
+        else:
+            response = generate_response("\n".join(messages), wa_id, name)
+            for segment in split_text(response):
+                reply.send(segment)
+    except Exception:
+        # Stop the sender thread, but don't send a reply cut off mid-sentence
+        reply.close(flush=False)
+        raise
+    reply.close()
+
+def queue_reply(wa_id, name, message_body):
+    # The job stays outstanding (and persisted) until its reply has been sent
+    get_mailbox(reply_to_messages).post(wa_id, name, message_body, done=defer_job())
+
+def process_whatsapp_message(message):
+    queue_reply(message.wa_id, message.name, message.text)
+
+def process_whatsapp_audio_message(message):
+    """
+    Voice notes run as a small dependency graph rather than a sequence:
 
-            logging.info(f"Audio information: {audio_info}")
+        read receipt + typing indicator ──────────────────────────┐
+        thread lookup/create ─────────────────────────────────────┤
+        media URL → download → transcription (cache lookups) ─────┴→ reply
 
-            if not audio_file_path:
-                logging.error("File path not found in the voice message")
-                return jsonify({"status": "error", "message": "File path not found in the voice message"}), 400
+    The receipt is handed to the delivery pool and the thread is resolved on
+    the pipeline executor while this thread fetches and transcribes the
+    audio; the reply waits only for the thread and the transcription.
+    """
+    logger.info(f"Incoming audio message {message.id} from wa_id {message.wa_id}")
 
-            audio_path = download_audio_file_internal(audio_file_path)
-            if not audio_path:
-                logging.error("Failed to download audio file from internal path")
+    try:
+        wa_id = message.wa_id
+        name = message.name
+
+        # Internal voice_file test messages have no real message id to mark as read
+        if message.media_id and current_app.config["READ_RECEIPTS"]:
+            send_message(get_read_receipt_input(message.id, current_app.config["TYPING_INDICATOR"]))
+        context = contextvars.copy_context()
+        conversation = get_pipeline_executor().submit(context.run, prepare_conversation, wa_id, name)
+
+        cache = get_transcription_cache()
+        cache_keys = []
+        transcription = None
+
+        if message.voice_file:
+            media = download_audio_file_internal(message.voice_file)
+            if not media:
+                logger.error("Failed to download audio file from internal path")
                 return jsonify({"status": "error", "message": "Failed to download audio file from internal path"}), 400
 
-        elif "audio" in message:
-            audio_info = message["audio"]
-            audio_id = audio_info.get("id")
-            if not audio_id:
-                logging.error("ID key not found in the audio message")
-                return jsonify({"status": "error", "message": "ID key not found in the audio message"}), 400
+        elif message.media_id:
+            audio_id = message.media_id
 
-            audio_url, mime_type = get_audio_url(audio_id)
-            if not audio_url:
-                logging.error("Failed to retrieve audio URL")
-                return jsonify({"status": "error", "message": "Failed to retrieve audio URL"}), 400
+            # A known media id skips the download entirely
+            cache_keys.append(media_key(audio_id))
+            transcription = cache.get(*cache_keys)
 
-            logging.info(f"Retrieved audio URL: {audio_url}")
+            if transcription is None:
+                audio_url, mime_type = get_audio_url(audio_id)
+                if not audio_url:
+                    logger.error("Failed to retrieve audio URL")
+                    return jsonify({"status": "error", "message": "Failed to retrieve audio URL"}), 400
 
-            audio_path = download_audio_file(audio_url, mime_type)
-            if not audio_path:
-                logging.error("Failed to download audio file")
-                return jsonify({"status": "error", "message": "Failed to download audio file"}), 400
+                logger.debug("Retrieved audio URL: %s", audio_url)
+
+                media = download_audio_file(audio_url, mime_type)
+                if not media:
+                    logger.error("Failed to download audio file")
+                    return jsonify({"status": "error", "message": "Failed to download audio file"}), 400
 
         else:
-            logging.error("Audio key not found in the message")
+            logger.error("Audio key not found in the message")
             return jsonify({"status": "error", "message": "Audio key not found in the message"}), 400
 
-        # Use Google Gemini Flash for transcription
-        transcription = transcribe_audio_with_gemini(audio_path)
-
-        # Generate a response using GPT-4
-        response = generate_response(transcription, wa_id, name)
-        response = process_text_for_whatsapp(response)
+        if transcription is None:
+            # Transcribe with the configured provider (Gemini Flash by default),
+            # unless the same bytes were transcribed before (forwarded voice notes).
+            # Closing the media removes its temp files even if transcription fails.
+            with media:
+                cache_keys.append(content_key(media.sha256))
+                transcription = cache.get(cache_keys[-1])
+                if transcription is None:
+                    TRANSCRIPTION_CACHE_LOOKUPS.inc(result="miss")
+                    with track("transcribe"):
+                        transcription = transcribe_audio(media)
+                else:
+                    TRANSCRIPTION_CACHE_LOOKUPS.inc(result="hit")
+            cache.set(cache_keys, transcription)
+        else:
+            TRANSCRIPTION_CACHE_LOOKUPS.inc(result="hit")
+            logger.info("Using cached transcription")
 
-        # Send the response back to the sender
-        data = get_text_message_input(wa_id, response)
-        send_message(data)
+        # The reply looks the thread up again; it just has to exist by now
+        try:
+            conversation.result()
+        except Exception as e:
+            logger.warning(f"Failed to prepare the conversation of wa_id {wa_id}: {e}")
 
-        # Clean up audio files
-        os.remove(audio_path)
+        # Generate a response and send it back to the sender
+        queue_reply(wa_id, name, transcription)
 
     except Exception as e:
-        logging.error(f"Error processing audio message: {e}")
+        logger.error(f"Error processing audio message: {e}")
         return jsonify({"status": "error", "message": "Failed to process audio message"}), 500
 
 def download_audio_file_internal(file_path):
     # This function assumes file_path is an internal path and needs to be handled accordingly
-    logging.info(f"Attempting to access internal audio file from path: {file_path}")
-    # Implement logic to access the internal file path here, if applicable
-    # This is a placeholder implementation
+    logger.debug("Attempting to access internal audio file from path: %s", file_path)
     try:
-        with open(file_path, 'rb') as f:
-            audio_path = "audio_internal.ogg"
-            with open(audio_path, 'wb') as audio_file:
-                audio_file.write(f.read())
-        return os.path.abspath(audio_path)
+        return open_local_media(
+            file_path,
+            "audio/ogg",
+            max_bytes=current_app.config["MEDIA_MAX_BYTES"],
+            spool_max_bytes=current_app.config["MEDIA_SPOOL_BYTES"],
+        )
     except Exception as e:
-        logging.error(f"Failed to access internal audio file: {e}")
+        logger.error(f"Failed to access internal audio file: {e}")
         return None
 
 def get_audio_url(media_id):
-    headers = {
-        "Content-type": "application/json",
-        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
-    }
-    url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{media_id}"
-    response = requests.get(url, headers=headers)
+    try:
+        with track("media_url"):
+            response = get_graph_client().get_media(media_id)
+    except requests.RequestException as e:
+        logger.error(f"Request to retrieve media URL failed: {e}")
+        return None, None
     if response.status_code == 200:
         media_data = response.json()
-        logging.info(f"Media data: {media_data}")
+        logger.debug("Media data: %s", media_data)
         return media_data.get("url"), media_data.get("mime_type")
     else:
-        logging.error(f"Failed to retrieve media URL: {response.status_code} {response.text}")
+        logger.error(f"Failed to retrieve media URL: {response.status_code} {response.text}")
         return None, None
 
 def download_audio_file(url, mime_type):
-    headers = {
-        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/68.0.3440.106 Safari/537.36",
-    }
-    logging.info(f"Attempting to download audio file from URL: {url}")
-    
-    try:
-        response = requests.get(url, headers=headers, stream=True)
-        logging.info(f"Response headers: {response.headers}")
-        logging.info(f"Response status code: {response.status_code}")
-
-        # Log the first 200 bytes of the content to check if it starts as expected
-        content_preview = response.content[:200]
-        logging.info(f"Content preview: {content_preview}")
-
-    except requests.RequestException as e:
-        logging.error(f"Request to download audio failed: {e}")
-        return None
-
-    if response.status_code == 200:
-        extension = 'ogg' if 'ogg' in mime_type else 'mp3'
-        audio_path = os.path.abspath(f"audio.{extension}")
-        try:
-            with open(audio_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            logging.info(f"Audio file downloaded successfully: {audio_path}")
-            return audio_path
-        except Exception as e:
-            logging.error(f"Failed to write audio file: {e}")
-            return None
-    else:
-        logging.error(f"Failed to download audio file: {response.status_code} {response.text}")
-        return None
+    """
+    Stream the audio into a per-message MediaFile. The caller must close it.
+    """
+    logger.debug("Attempting to download audio file from URL: %s", url)
 
-def convert_to_wav(input_path):
-    output_path = os.path.splitext(input_path)[0] + ".wav"
     try:
-        result = subprocess.run(
-            ["ffmpeg", "-i", input_path, output_path],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        logging.info(f"Converted audio file to WAV format: {output_path}")
-        logging.info(f"FFmpeg stdout: {result.stdout.decode()}")
-        logging.info(f"FFmpeg stderr: {result.stderr.decode()}")
-        return output_path
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to convert audio file to WAV: {e.stderr.decode()}")
+        with track("media_download"):
+            return download_media(
+                url,
+                mime_type,
+                max_bytes=current_app.config["MEDIA_MAX_BYTES"],
+                spool_max_bytes=current_app.config["MEDIA_SPOOL_BYTES"],
+                headers=MEDIA_DOWNLOAD_HEADERS,
+            )
+    except MediaError as e:
+        logger.error(f"Failed to download audio file: {e}")
         return None
 
-def transcribe_audio_file(audio_path):
-    logging.info(f"Starting transcription for file: {audio_path}")
-    result = model.transcribe(audio_path)
-    return result['text']
-
-def is_valid_whatsapp_message(body):
+def process_webhook_event(payload):
     """
-    Check if the incoming webhook event has a valid WhatsApp message structure.
+    Run the full reply pipeline for one queued message. Called from the
+    background job workers, never from the request thread.
     """
-    return (
-        body.get("object")
-        and body.get("entry")
-        and body["entry"][0].get("changes")
-        and body["entry"][0]["changes"][0].get("value")
-        and body["entry"][0]["changes"][0]["value"].get("messages")
-        and body["entry"][0]["changes"][0]["value"]["messages"][0]
-    )
+    message = InboundMessage.from_dict(payload)
+    with log_context(message_id=message.id, wa_id=message.wa_id):
+        if message.type == "text":
+            process_whatsapp_message(message)
+        elif message.type == "audio":
+            process_whatsapp_audio_message(message)
+        else:
+            logger.info(f"Ignoring unsupported message type: {message.type}")
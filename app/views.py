@@ -1,50 +1,99 @@
 import logging
 import json
-from flask import Blueprint, request, jsonify, current_app
+import uuid
+import hmac
+from flask import Blueprint, Response, request, jsonify, current_app, g
 from .decorators.security import signature_required
-from .utils.whatsapp_utils import (
-    process_whatsapp_message,
-    process_whatsapp_audio_message,
-    is_valid_whatsapp_message,
-)
+from .services.dedup_service import get_deduplicator
+from .utils.json_utils import loads
+from .utils.logging_utils import bind_log_context, unbind_log_context
+from .utils.metrics import registry, track
+from .utils.webhook_parser import parse_webhook
+
+logger = logging.getLogger(__name__)
 
 webhook_blueprint = Blueprint("webhook", __name__)
 
+WEBHOOK_MESSAGES = registry.counter(
+    "zowobo_webhook_messages_total", "Inbound messages by what the webhook did with them.", ("result",)
+)
+
+
+@webhook_blueprint.before_app_request
+def bind_request_id():
+    request_id = request.headers.get("X-Request-Id") or uuid.uuid4().hex
+    g.log_context_token = bind_log_context(request_id=request_id)
+
+
+@webhook_blueprint.teardown_app_request
+def unbind_request_id(exc=None):
+    token = g.pop("log_context_token", None)
+    if token is not None:
+        unbind_log_context(token)
+
+
+@track("webhook")
 def handle_message():
     """
     Handle incoming webhook events from the WhatsApp API.
     This function processes incoming WhatsApp messages and other events,
-    such as delivery statuses. If the event is a valid message, it gets
-    processed. If the incoming payload is not a recognized WhatsApp event,
-    an error is returned.
+    such as delivery statuses. If the event is a valid message, it is queued
+    for the background workers and acknowledged right away. If the incoming
+    payload is not a recognized WhatsApp event, an error is returned.
     Returns:
         response: A tuple containing a JSON response and an HTTP status code.
     """
-    body = request.get_json()
-    logging.info(f"Request body: {body}")
+    try:
+        # Parsed once by signature_required; fall back for unsigned callers
+        body = g.get("webhook_body")
+        if body is None:
+            body = loads(request.get_data(cache=True))
 
-    # Check if it's a WhatsApp status update
-    if body.get("entry", [{}])[0].get("changes", [{}])[0].get("value", {}).get("statuses"):
-        logging.info("Received a WhatsApp status update.")
-        return jsonify({"status": "ok"}), 200
+        batch = parse_webhook(body)
+        logger.debug(f"Webhook with {len(batch.messages)} message(s) and {len(batch.statuses)} status(es)")
 
-    try:
-        if is_valid_whatsapp_message(body):
-            message_type = body["entry"][0]["changes"][0]["value"]["messages"][0]["type"]
-            
-            if message_type == "text":
-                process_whatsapp_message(body)
-            elif message_type == "audio":
-                process_whatsapp_audio_message(body)
-                
+        # WhatsApp status updates (sent, delivered, read) need no processing
+        if batch.statuses:
+            logger.info(f"Received {len(batch.statuses)} WhatsApp status update(s).")
+
+        if batch.messages:
+            # Fan every message out to the workers. Meta redelivers slow or failed
+            # webhooks, so work is only scheduled once per message id.
+            job_queue = current_app.extensions["job_queue"]
+            deduplicator = get_deduplicator()
+            rejected = 0
+            for message in batch.messages:
+                if message.id and not deduplicator.claim(message.id):
+                    logger.info(f"Ignoring duplicate delivery of message {message.id}")
+                    WEBHOOK_MESSAGES.inc(result="duplicate")
+                    continue
+                try:
+                    accepted = job_queue.submit(message.to_dict())
+                except Exception:
+                    # e.g. persisting the job failed: let Meta's redelivery retry it
+                    if message.id:
+                        deduplicator.release(message.id)
+                    raise
+                if not accepted:
+                    if message.id:
+                        deduplicator.release(message.id)
+                    WEBHOOK_MESSAGES.inc(result="rejected")
+                    rejected += 1
+                else:
+                    WEBHOOK_MESSAGES.inc(result="queued")
+
+            if rejected:
+                return jsonify({"status": "error", "message": "Server busy"}), 503
+            return jsonify({"status": "ok"}), 200
+        elif batch.statuses:
             return jsonify({"status": "ok"}), 200
         else:
             return jsonify({"status": "error", "message": "Not a WhatsApp API event"}), 404
     except json.JSONDecodeError:
-        logging.error("Failed to decode JSON")
+        logger.error("Failed to decode JSON")
         return jsonify({"status": "error", "message": "Invalid JSON provided"}), 400
     except Exception as e:
-        logging.error(f"Exception in handle_message: {e}")
+        logger.error(f"Exception in handle_message: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 def verify():
@@ -55,13 +104,13 @@ def verify():
 
     if mode and token:
         if mode == "subscribe" and token == current_app.config["VERIFY_TOKEN"]:
-            logging.info("WEBHOOK_VERIFIED")
+            logger.info("WEBHOOK_VERIFIED")
             return challenge, 200
         else:
-            logging.info("VERIFICATION_FAILED")
+            logger.info("VERIFICATION_FAILED")
             return jsonify({"status": "error", "message": "Verification failed"}), 403
     else:
-        logging.info("MISSING_PARAMETER")
+        logger.info("MISSING_PARAMETER")
         return jsonify({"status": "error", "message": "Missing parameters"}), 400
 
 @webhook_blueprint.route("/webhook", methods=["GET"])
@@ -72,3 +121,11 @@ def webhook_get():
 @signature_required
 def webhook_post():
     return handle_message()
+
+@webhook_blueprint.route("/metrics", methods=["GET"])
+def metrics():
+    # Optional bearer token so the endpoint can be exposed next to the webhook
+    token = current_app.config["METRICS_TOKEN"]
+    if token and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return jsonify({"status": "error", "message": "Unauthorized"}), 401
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,10 @@
+"""
+ASGI entry point: the webhook on an asyncio event loop instead of Flask
+worker threads. Run with any ASGI server, e.g.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+"""
+
+from app.asgi import create_asgi_app
+
+app = create_asgi_app()
@@ -0,0 +1,432 @@
+"""
+Local stand-ins for the external APIs the bot talks to, for offline benchmarks.
+
+- FakeGraph:  WhatsApp Cloud API messages, media lookup and media download
+- FakeOpenAI: Assistants assistants/threads/messages/runs, streaming and polling
+- FakeGemini: generateContent over the REST transport
+
+Each server runs on 127.0.0.1 in a background thread and sleeps for a
+latency drawn from a `Latency` distribution before answering, so the app
+can be load tested without network access or API keys.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class Latency:
+    """
+    A latency distribution in seconds, parsed from a spec such as:
+
+        0.2                  fixed
+        fixed:0.2
+        uniform:0.1,0.4
+        normal:0.3,0.05      mean, standard deviation (clamped at 0)
+        lognormal:0.8,0.5    median, sigma (long-tailed, like LLM calls)
+    """
+
+    def __init__(self, spec="0"):
+        self.spec = spec
+        kind, _, args = spec.partition(":") if ":" in spec else ("fixed", "", spec)
+        self.kind = kind
+        self.args = [float(arg) for arg in args.split(",") if arg]
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if expected.get(kind) != len(self.args):
+            raise ValueError(f"Invalid latency spec: {spec!r}")
+
+    def sample(self):
+        if self.kind == "fixed":
+            return self.args[0]
+        if self.kind == "uniform":
+            return random.uniform(*self.args)
+        if self.kind == "normal":
+            return max(0.0, random.gauss(*self.args))
+        median, sigma = self.args
+        return random.lognormvariate(0, sigma) * median
+
+    def wait(self):
+        delay = self.sample()
+        if delay > 0:
+            time.sleep(delay)
+
+    def __repr__(self):
+        return f"Latency({self.spec!r})"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real APIs; every response sets Content-Length or is chunked
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.service.handle(self, "GET")
+
+    def do_POST(self):
+        self.server.service.handle(self, "POST")
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        return json.loads(body) if body else {}
+
+    def send_body(self, body, status=200, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_events(self, events, duration=0.0):
+        """
+        Send server-sent events one chunk at a time, spread evenly over
+        `duration` seconds, like tokens arriving from a model.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = duration / max(len(events), 1)
+        for event in events:
+            if interval > 0:
+                time.sleep(interval)
+            data = event.encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FakeService:
+    """
+    Base class: a ThreadingHTTPServer routing (method, path regex) to handlers.
+    """
+
+    routes = ()
+
+    def __init__(self, latency="0", port=0):
+        self.latency = latency if isinstance(latency, Latency) else Latency(latency)
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self.server.daemon_threads = True
+        self.server.service = self
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server_thread = None
+        self._routes = [(method, re.compile(pattern), getattr(self, name)) for method, pattern, name in self.routes]
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._server_thread = threading.Thread(target=self.server.serve_forever, name=type(self).__name__, daemon=True)
+        self._server_thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def handle(self, request, method):
+        with self._lock:
+            self.requests += 1
+        parsed = urlparse(request.path)
+        for route_method, pattern, handler in self._routes:
+            match = route_method == method and pattern.fullmatch(parsed.path)
+            if match:
+                try:
+                    handler(request, parse_qs(parsed.query), *match.groups())
+                except Exception as e:
+                    request.send_body({"error": {"message": f"{type(e).__name__}: {e}"}}, status=500)
+                return
+        request.send_body({"error": {"message": f"No route for {method} {parsed.path}"}}, status=404)
+
+
+class FakeGraph(FakeService):
+    """
+    WhatsApp Cloud API. Records when each outbound message reaches it, keyed
+    by recipient, so a load test can measure webhook-to-reply latency.
+    """
+
+    routes = (
+        ("POST", r"/[^/]+/([^/]+)/messages", "send_message"),
+        ("GET", r"/media-download/([^/]+)", "download_media"),
+        ("GET", r"/[^/]+/([^/]+)", "get_media"),
+    )
+
+    def __init__(self, latency="0", port=0, media_bytes=24 * 1024):
+        super().__init__(latency, port)
+        self.media_bytes = media_bytes
+        self.sent = {}
+        self.read_receipts = 0
+        self._sent_event = threading.Condition()
+
+    def send_message(self, request, query, phone_number_id):
+        data = request.read_json()
+        self.latency.wait()
+        if data.get("status") == "read":
+            with self._lock:
+                self.read_receipts += 1
+            request.send_body({"success": True})
+            return
+        with self._sent_event:
+            self.sent.setdefault(data.get("to"), []).append((time.perf_counter(), data))
+            self._sent_event.notify_all()
+        request.send_body(
+            {
+                "messaging_product": "whatsapp",
+                "contacts": [{"input": data.get("to"), "wa_id": data.get("to")}],
+                "messages": [{"id": f"wamid.fake.{uuid.uuid4().hex}"}],
+            }
+        )
+
+    def get_media(self, request, query, media_id):
+        self.latency.wait()
+        request.send_body(
+            {
+                "messaging_product": "whatsapp",
+                "url": f"{self.url}/media-download/{media_id}",
+                "mime_type": "audio/ogg",
+                "file_size": self.media_bytes,
+                "id": media_id,
+            }
+        )
+
+    def download_media(self, request, query, media_id):
+        self.latency.wait()
+        # Unique bytes per media id so the transcription cache never hits
+        seed = media_id.encode("utf-8")
+        body = (seed * (self.media_bytes // len(seed) + 1))[: self.media_bytes]
+        request.send_body(body, content_type="audio/ogg")
+
+    def wait_for(self, recipients, timeout):
+        """
+        Block until every recipient got a message or the timeout passes.
+        Returns the number of recipients still waiting.
+        """
+        deadline = time.monotonic() + timeout
+        with self._sent_event:
+            while True:
+                missing = sum(1 for recipient in recipients if recipient not in self.sent)
+                remaining = deadline - time.monotonic()
+                if not missing or remaining <= 0:
+                    return missing
+                self._sent_event.wait(remaining)
+
+
+class FakeOpenAI(FakeService):
+    """
+    OpenAI Assistants and Chat Completions APIs. `latency` is how long a run
+    or a completion takes; `api_latency` applies to every other call.
+    """
+
+    routes = (
+        ("GET", r"/v1/assistants/([^/]+)", "get_assistant"),
+        ("POST", r"/v1/threads", "create_thread"),
+        ("GET", r"/v1/threads/([^/]+)", "get_thread"),
+        ("POST", r"/v1/threads/([^/]+)/messages", "create_message"),
+        ("GET", r"/v1/threads/([^/]+)/messages", "list_messages"),
+        ("POST", r"/v1/threads/([^/]+)/runs", "create_run"),
+        ("GET", r"/v1/threads/([^/]+)/runs/([^/]+)", "get_run"),
+        ("POST", r"/v1/threads/([^/]+)/runs/([^/]+)/cancel", "cancel_run"),
+        ("POST", r"/v1/chat/completions", "create_chat_completion"),
+    )
+
+    def __init__(self, latency="0", port=0, api_latency="0", reply="Mwen la pou ede w. Kisa ou bezwen?"):
+        super().__init__(latency, port)
+        self.api_latency = Latency(api_latency)
+        self.reply = reply
+        self._runs = {}
+
+    def get_assistant(self, request, query, assistant_id):
+        self.api_latency.wait()
+        request.send_body(
+            {
+                "id": assistant_id,
+                "object": "assistant",
+                "created_at": int(time.time()),
+                "name": "Zowobo",
+                "model": "gpt-4o-mini",
+                "instructions": "",
+                "tools": [],
+                "metadata": {},
+            }
+        )
+
+    def create_thread(self, request, query):
+        request.read_json()
+        self.api_latency.wait()
+        request.send_body(self._thread(f"thread_{uuid.uuid4().hex}"))
+
+    def get_thread(self, request, query, thread_id):
+        self.api_latency.wait()
+        request.send_body(self._thread(thread_id))
+
+    def create_message(self, request, query, thread_id):
+        data = request.read_json()
+        self.api_latency.wait()
+        request.send_body(self._message(thread_id, None, "user", data.get("content", "")))
+
+    def list_messages(self, request, query, thread_id):
+        self.api_latency.wait()
+        run_id = query.get("run_id", [None])[0]
+        message = self._message(thread_id, run_id, "assistant", self.reply)
+        request.send_body(
+            {"object": "list", "data": [message], "first_id": message["id"], "last_id": message["id"], "has_more": False}
+        )
+
+    def create_run(self, request, query, thread_id):
+        data = request.read_json()
+        run = self._run(thread_id, data.get("assistant_id"), "queued")
+
+        if not data.get("stream"):
+            self.api_latency.wait()
+            self._runs[run["id"]] = time.monotonic() + self.latency.sample()
+            request.send_body(run)
+            return
+
+        # The reply streams in word by word over the run's duration
+        message = self._message(thread_id, run["id"], "assistant", self.reply)
+        deltas = [
+            {
+                "id": message["id"],
+                "object": "thread.message.delta",
+                "delta": {"content": [{"index": 0, "type": "text", "text": {"value": word}}]},
+            }
+            for word in self._words()
+        ]
+        events = (
+            [
+                ("thread.run.created", run),
+                ("thread.run.in_progress", {**run, "status": "in_progress"}),
+                ("thread.message.created", {**message, "status": "in_progress", "content": []}),
+            ]
+            + [("thread.message.delta", delta) for delta in deltas]
+            + [
+                ("thread.message.completed", message),
+                ("thread.run.completed", {**run, "status": "completed", "completed_at": int(time.time())}),
+            ]
+        )
+        chunks = [f"event: {name}\ndata: {json.dumps(data)}\n\n" for name, data in events]
+        chunks.append("event: done\ndata: [DONE]\n\n")
+        request.send_events(chunks, self.latency.sample())
+
+    def get_run(self, request, query, thread_id, run_id):
+        self.api_latency.wait()
+        finishes_at = self._runs.get(run_id, 0)
+        status = "completed" if time.monotonic() >= finishes_at else "in_progress"
+        if status == "completed":
+            self._runs.pop(run_id, None)
+        request.send_body(self._run(thread_id, None, status, run_id))
+
+    def cancel_run(self, request, query, thread_id, run_id):
+        self._runs.pop(run_id, None)
+        request.send_body(self._run(thread_id, None, "cancelled", run_id))
+
+    def create_chat_completion(self, request, query):
+        data = request.read_json()
+        duration = self.latency.sample()
+        completion = {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "created": int(time.time()),
+            "model": data.get("model", "gpt-4o-mini"),
+        }
+        if not data.get("stream"):
+            time.sleep(duration)
+            choice = {"index": 0, "message": {"role": "assistant", "content": self.reply}, "finish_reason": "stop"}
+            request.send_body({**completion, "object": "chat.completion", "choices": [choice]})
+            return
+
+        chunks = [{"role": "assistant", "content": ""}] + [{"content": word} for word in self._words()]
+        events = [
+            {
+                **completion,
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+            }
+            for delta in chunks
+        ]
+        events[-1]["choices"][0]["finish_reason"] = "stop"
+        request.send_events([f"data: {json.dumps(event)}\n\n" for event in events] + ["data: [DONE]\n\n"], duration)
+
+    def _words(self):
+        return re.findall(r"\S+\s*", self.reply)
+
+    @staticmethod
+    def _thread(thread_id):
+        return {"id": thread_id, "object": "thread", "created_at": int(time.time()), "metadata": {}}
+
+    @staticmethod
+    def _message(thread_id, run_id, role, text):
+        return {
+            "id": f"msg_{uuid.uuid4().hex}",
+            "object": "thread.message",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "run_id": run_id,
+            "role": role,
+            "status": "completed",
+            "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+            "attachments": [],
+            "metadata": {},
+        }
+
+    @staticmethod
+    def _run(thread_id, assistant_id, status, run_id=None):
+        return {
+            "id": run_id or f"run_{uuid.uuid4().hex}",
+            "object": "thread.run",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "assistant_id": assistant_id,
+            "status": status,
+            "model": "gpt-4o-mini",
+            "instructions": "",
+            "tools": [],
+            "metadata": {},
+            "last_error": None,
+            "incomplete_details": None,
+        }
+
+
+class FakeGemini(FakeService):
+    """
+    Gemini generateContent, as called by google-generativeai's REST transport.
+    """
+
+    routes = (("POST", r"/v1beta/models/([^/:]+):generateContent", "generate_content"),)
+
+    def __init__(self, latency="0", port=0, transcription="Bonjou, mwen ta renmen konnen ki lè li ye."):
+        super().__init__(latency, port)
+        self.transcription = transcription
+
+    def generate_content(self, request, query, model):
+        request.read_json()
+        self.latency.wait()
+        request.send_body(
+            {
+                "candidates": [
+                    {
+                        "content": {"parts": [{"text": self.transcription}], "role": "model"},
+                        "finishReason": "STOP",
+                        "index": 0,
+                    }
+                ],
+                "usageMetadata": {"promptTokenCount": 1, "candidatesTokenCount": 1, "totalTokenCount": 2},
+            }
+        )
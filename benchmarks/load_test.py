@@ -0,0 +1,205 @@
+"""
+Offline end-to-end load test.
+
+Starts local stand-ins for the Graph, OpenAI Assistants and Gemini APIs
+(see fake_services.py), serves create_app() on a local port and replays
+signed text and audio webhooks at a fixed concurrency. Reports webhook
+acknowledgement latency, webhook-to-first-reply-message latency, throughput and the
+per-stage means from the app's own metrics.
+
+    python benchmarks/load_test.py --requests 500 --concurrency 16 --audio-ratio 0.3 \\
+        --openai-latency lognormal:0.8,0.4 --gemini-latency uniform:0.3,0.9 --graph-latency 0.05
+
+Every webhook comes from a distinct wa_id, so replies are never coalesced
+and each one creates a fresh thread.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_services import FakeGemini, FakeGraph, FakeOpenAI, Latency  # noqa: E402
+from webhook_ingest import APP_SECRET, sign  # noqa: E402
+
+PHONE_NUMBER_ID = "123456"
+
+
+def make_webhook(index, audio):
+    wa_id = f"509{index:08d}"
+    message = {"from": wa_id, "id": f"wamid.load.{index}", "timestamp": str(int(time.time()))}
+    if audio:
+        message.update(type="audio", audio={"id": f"media{index}", "mime_type": "audio/ogg; codecs=opus", "voice": True})
+    else:
+        message.update(type="text", text={"body": "Bonjou Zowobo, kijan ou ye?"})
+    value = {
+        "messaging_product": "whatsapp",
+        "metadata": {"display_phone_number": "15550000000", "phone_number_id": PHONE_NUMBER_ID},
+        "contacts": [{"profile": {"name": f"User {index}"}, "wa_id": wa_id}],
+        "messages": [message],
+    }
+    body = {"object": "whatsapp_business_account", "entry": [{"id": "1", "changes": [{"value": value, "field": "messages"}]}]}
+    return wa_id, body
+
+
+def percentiles(values):
+    values = sorted(values)
+    count = len(values)
+    if not count:
+        return "n/a"
+    return ", ".join(f"p{p} {values[min(count - 1, count * p // 100)] * 1000:,.1f} ms" for p in (50, 95, 99))
+
+
+def stage_means(metrics_text):
+    sums, counts = {}, {}
+    for line in metrics_text.splitlines():
+        for suffix, target in (("_sum", sums), ("_count", counts)):
+            prefix = f"zowobo_stage_duration_seconds{suffix}{{stage=\""
+            if line.startswith(prefix):
+                stage, value = line[len(prefix) :].split('"} ')
+                target[stage] = float(value)
+    return {stage: (sums[stage] / counts[stage], int(counts[stage])) for stage in sums if counts.get(stage)}
+
+
+def configure_environment(args, graph, openai, gemini, workdir):
+    # Must be set before the app package is imported
+    os.environ.update(
+        {
+            "APP_SECRET": APP_SECRET,
+            "ACCESS_TOKEN": "benchmark",
+            "VERSION": "v18.0",
+            "PHONE_NUMBER_ID": PHONE_NUMBER_ID,
+            "GRAPH_API_BASE_URL": graph.url,
+            "OPENAI_API_KEY": "benchmark",
+            "OPENAI_ASSISTANT_ID": "asst_benchmark",
+            "OPENAI_BASE_URL": f"{openai.url}/v1",
+            "ASSISTANT_RUN_STREAMING": "true" if args.streaming else "false",
+            "RESPONSE_ENGINE": args.engine,
+            "REPLY_STREAMING": "true" if args.stream_replies else "false",
+            "GEMINI_API_KEY": "benchmark",
+            "GEMINI_API_ENDPOINT": gemini.url,
+            "TRANSCRIPTION_PROVIDER": "gemini",
+            "WORKER_COUNT": str(args.workers),
+            "MESSAGE_DEBOUNCE_MS": str(args.debounce_ms),
+            "CONVERSATION_DB": os.path.join(workdir, "threads.sqlite3"),
+            "HISTORY_DB": os.path.join(workdir, "history.sqlite3"),
+            "LEGACY_THREADS_DB": os.path.join(workdir, "threads_db"),
+            "DEDUP_DB_PATH": "",
+            "TRANSCRIPTION_CACHE_PATH": "",
+            "SEND_DEAD_LETTER_PATH": "",
+            "LOG_LEVEL": args.log_level,
+        }
+    )
+
+
+def run(args, graph, openai, gemini):
+    import requests
+    from werkzeug.serving import make_server
+
+    from app import create_app
+    from app.utils.metrics import registry
+
+    app = create_app()
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="app-server", daemon=True).start()
+    webhook_url = f"http://127.0.0.1:{server.server_port}/webhook"
+
+    rng = random.Random(args.seed)
+    webhooks = [make_webhook(i, rng.random() < args.audio_ratio) for i in range(args.requests)]
+    local = threading.local()
+
+    def post(item):
+        wa_id, body = item
+        payload = json.dumps(body).encode("utf-8")
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        sent = time.perf_counter()
+        response = session.post(
+            webhook_url,
+            data=payload,
+            headers={"X-Hub-Signature-256": sign(payload), "Content-Type": "application/json"},
+        )
+        return wa_id, sent, time.perf_counter() - sent, response.status_code
+
+    print(
+        f"Replaying {args.requests} webhooks ({args.audio_ratio:.0%} audio) at concurrency {args.concurrency}, "
+        f"{args.workers} job workers, engine={args.engine}, streaming={'on' if args.streaming else 'off'}"
+    )
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(post, webhooks))
+    ingest_elapsed = time.perf_counter() - started
+
+    accepted = [r for r in results if r[3] == 200]
+    missing = graph.wait_for([wa_id for wa_id, *_ in accepted], args.timeout)
+    elapsed = time.perf_counter() - started
+
+    replies = []
+    for wa_id, sent, _, _ in accepted:
+        if wa_id in graph.sent:
+            replies.append(graph.sent[wa_id][0][0] - sent)
+    rejected = len(results) - len(accepted)
+
+    print("Results:")
+    print(f"  webhook ack:    {len(results) / ingest_elapsed:,.0f} req/s, {percentiles([r[2] for r in results])}")
+    print(f"  first reply:    {percentiles(replies)}")
+    print(f"  throughput:     {len(replies) / elapsed:,.1f} replies/s ({len(replies)} in {elapsed:.2f}s)")
+    if rejected or missing:
+        print(f"  rejected: {rejected}, no reply within {args.timeout:.0f}s: {missing}")
+    print(
+        f"  upstream calls: graph {graph.requests} ({graph.read_receipts} read receipts), "
+        f"openai {openai.requests}, gemini {gemini.requests}"
+    )
+
+    print("Stage means (from app metrics):")
+    for stage, (mean, count) in sorted(stage_means(registry.render()).items()):
+        print(f"  {stage:16s} {mean * 1000:10,.1f} ms  x{count}")
+
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8, help="webhooks in flight at once")
+    parser.add_argument("--audio-ratio", type=float, default=0.25, help="share of voice notes among webhooks")
+    parser.add_argument("--workers", type=int, default=4, help="WORKER_COUNT for the app")
+    parser.add_argument("--graph-latency", default="uniform:0.02,0.08", help="see fake_services.Latency")
+    parser.add_argument("--openai-latency", default="lognormal:0.8,0.4", help="time for a run to complete")
+    parser.add_argument("--openai-api-latency", default="uniform:0.05,0.15", help="every other OpenAI call")
+    parser.add_argument("--gemini-latency", default="uniform:0.3,0.9")
+    parser.add_argument("--media-bytes", type=int, default=24 * 1024, help="size of each fake voice note")
+    parser.add_argument("--engine", choices=("assistants", "chat"), default="assistants", help="RESPONSE_ENGINE")
+    parser.add_argument("--stream-replies", action="store_true", help="REPLY_STREAMING: send segments as generated")
+    parser.add_argument("--reply", help="text every fake run or completion answers with")
+    parser.add_argument("--no-streaming", dest="streaming", action="store_false", help="poll runs instead")
+    parser.add_argument("--debounce-ms", type=int, default=0, help="MESSAGE_DEBOUNCE_MS for the app")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for outstanding replies")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    graph = FakeGraph(Latency(args.graph_latency), media_bytes=args.media_bytes)
+    openai = FakeOpenAI(
+        Latency(args.openai_latency),
+        api_latency=args.openai_api_latency,
+        **({"reply": args.reply} if args.reply else {}),
+    )
+    gemini = FakeGemini(Latency(args.gemini_latency))
+    with graph, openai, gemini, tempfile.TemporaryDirectory() as workdir:
+        configure_environment(args, graph, openai, gemini, workdir)
+        run(args, graph, openai, gemini)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Microbenchmark for the webhook ingest path (POST /webhook).
+
+Runs entirely in-process with Flask's test client: no network, no OpenAI,
+no Graph API. Queued jobs are dropped, so this measures only signature
+verification, parsing, deduplication and enqueueing, with the default
+configuration (on-disk dedup database, bounded job queue) in a scratch
+directory.
+
+The same requests are then replayed against the endpoint as it was at
+--baseline (default: the first commit), exported to a temporary directory
+and run in a subprocess. That endpoint handled messages inline, so its
+message handlers are replaced by no-ops the same way; it also loads the
+Whisper model on import, so it needs the full requirements installed.
+
+    python benchmarks/webhook_ingest.py --requests 5000
+    python benchmarks/webhook_ingest.py --baseline none  # skip the baseline run
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APP_SECRET = "benchmark-secret"
+
+
+def make_body(index, messages=1):
+    value = {
+        "messaging_product": "whatsapp",
+        "metadata": {"display_phone_number": "15550000000", "phone_number_id": "123456"},
+        "contacts": [{"profile": {"name": f"User {index}"}, "wa_id": f"509{index:08d}"}],
+        "messages": [
+            {
+                "from": f"509{index:08d}",
+                "id": f"wamid.bench.{index}.{n}",
+                "timestamp": str(int(time.time())),
+                "text": {"body": "Bonjou Zowobo, kijan ou ye? " * 4},
+                "type": "text",
+            }
+            for n in range(messages)
+        ],
+    }
+    body = {"object": "whatsapp_business_account", "entry": [{"id": "1", "changes": [{"value": value, "field": "messages"}]}]}
+    return json.dumps(body).encode("utf-8")
+
+
+def sign(payload):
+    return "sha256=" + hmac.new(APP_SECRET.encode("latin-1"), payload, hashlib.sha256).hexdigest()
+
+
+def bench_primitives(payload):
+    """
+    Compare the individual steps of the old and new ingest code.
+    """
+    from app.utils.json_utils import loads
+
+    key = APP_SECRET.encode("latin-1")
+    text = payload.decode("utf-8")
+    n = 20000
+
+    results = {
+        "hmac str->bytes (old)": timeit.timeit(
+            lambda: hmac.new(bytes(APP_SECRET, "latin-1"), msg=payload.decode("utf-8").encode("utf-8"), digestmod=hashlib.sha256).hexdigest(),
+            number=n,
+        ),
+        "hmac raw bytes (new)": timeit.timeit(
+            lambda: hmac.new(key, msg=payload, digestmod=hashlib.sha256).hexdigest(), number=n
+        ),
+        "json.loads": timeit.timeit(lambda: json.loads(text), number=n),
+        "json_utils.loads": timeit.timeit(lambda: loads(payload), number=n),
+        "format body for log line (old)": timeit.timeit(lambda: f"Request body: {json.loads(text)}", number=n),
+    }
+    for name, seconds in results.items():
+        print(f"  {name:32s} {seconds / n * 1e6:8.2f} us/op")
+
+
+def bench_endpoint(total, messages):
+    import logging
+
+    from app import create_app
+
+    app = create_app()
+    logging.getLogger().setLevel(logging.WARNING)
+    job_queue = app.extensions.get("job_queue")
+    if job_queue is not None:
+        job_queue.handler = lambda payload: None
+    else:
+        # The baseline endpoint processes messages inline; drop them the same way
+        from app import views
+
+        views.process_whatsapp_message = views.process_whatsapp_audio_message = lambda body: None
+
+    client = app.test_client()
+    requests = []
+    for i in range(total):
+        payload = make_body(i, messages)
+        requests.append((payload, {"X-Hub-Signature-256": sign(payload), "Content-Type": "application/json"}))
+
+    # Warm up
+    client.post("/webhook", data=requests[0][0], headers=requests[0][1])
+
+    latencies = []
+    started = time.perf_counter()
+    for payload, headers in requests[1:]:
+        t0 = time.perf_counter()
+        response = client.post("/webhook", data=payload, headers=headers)
+        latencies.append(time.perf_counter() - t0)
+        assert response.status_code == 200, response.data
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    count = len(latencies)
+    print(f"  {count} requests in {elapsed:.2f}s -> {count / elapsed:,.0f} req/s")
+    for p in (50, 95, 99):
+        print(f"  p{p}: {latencies[min(count - 1, count * p // 100)] * 1000:.3f} ms")
+
+
+def run_baseline(revision, total, messages):
+    """
+    Export the tree at `revision` and run bench_endpoint() against it in a
+    subprocess, from a scratch directory like the current tree.
+    """
+    if revision == "root":
+        revision = subprocess.run(
+            ["git", "rev-list", "--max-parents=0", "HEAD"], cwd=ROOT, check=True, capture_output=True, text=True
+        ).stdout.split()[-1]
+    with tempfile.TemporaryDirectory() as tree, tempfile.TemporaryDirectory() as workdir:
+        archive = subprocess.run(["git", "archive", revision, "app"], cwd=ROOT, check=True, capture_output=True)
+        subprocess.run(["tar", "-x", "-C", tree], input=archive.stdout, check=True)
+        print(f"POST /webhook at {revision[:12]} (baseline):", flush=True)
+        subprocess.run(
+            [
+                sys.executable, os.path.abspath(__file__), "--endpoint-only", "--app-root", tree,
+                "--requests", str(total), "--messages", str(messages),
+            ],
+            cwd=workdir,
+            check=True,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--messages", type=int, default=1, help="messages per webhook delivery")
+    parser.add_argument("--baseline", default="root", help='git revision to compare against, "root" or "none"')
+    parser.add_argument("--app-root", default=ROOT, help=argparse.SUPPRESS)
+    parser.add_argument("--endpoint-only", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Must be set before the app package is imported
+    sys.path.insert(0, args.app_root)
+    os.environ["APP_SECRET"] = APP_SECRET
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+    if args.endpoint_only:
+        bench_endpoint(args.requests, args.messages)
+        return
+
+    print("Ingest primitives:")
+    bench_primitives(make_body(0, args.messages))
+    # Default settings, so the dedup database and any other state files are
+    # created in a scratch directory rather than the working tree
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        print("POST /webhook:", flush=True)
+        bench_endpoint(args.requests, args.messages)
+        os.chdir(ROOT)
+    if args.baseline != "none":
+        run_baseline(args.baseline, args.requests, args.messages)
+
+
+if __name__ == "__main__":
+    main()